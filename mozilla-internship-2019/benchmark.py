@@ -0,0 +1,177 @@
+'''
+Benchmark the analysers on synthetic inputs (see synthetic.py) and keep a history of the
+results, to tell whether a change makes the nightly analysis faster or slower.
+
+For every size, the inputs are:
+
+    wptreport   `size` results: size / 10 tests × 10 reports
+    outputs     size / 10 run outputs: size / 1000 tests × 100 runs
+    crash log   size / 10 crash blocks
+
+Every analyser runs in its own process. Its wall time, throughput in items (results,
+outputs or crash blocks) per second and peak RSS are appended to the history file, and
+compared against the last entry for the same analyser and size.
+
+python3 benchmark.py --sizes 1000,10000,100000 --history benchmark_history.json
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+here = os.path.dirname(os.path.abspath(__file__))
+scripts_dir = os.path.join(here, "..", "scripts")
+
+reports = 10
+runs = 100
+
+
+def analysers(inputs):
+    """(name, command, items, input path) of every analyser to benchmark."""
+    py = sys.executable
+    report_dir = inputs["report_dir"]
+    cache_dir = inputs["work_dir"] + "/cache"
+    return [
+        ("analyse_json_wpt", [py, here + "/analyse_json_wpt.py", report_dir, "all"],
+         inputs["results"], report_dir),
+        ("wpt_cache_convert", [py, here + "/wpt_cache.py", "convert", report_dir, cache_dir],
+         inputs["results"], report_dir),
+        ("wpt_cache_analyse", [py, here + "/wpt_cache.py", "analyse", cache_dir, "all"],
+         inputs["results"], report_dir),
+        ("status_sets", [py, here + "/status_sets.py", "update",
+                         inputs["work_dir"] + "/state.json", report_dir,
+                         inputs["work_dir"] + "/sets"],
+         inputs["results"], report_dir),
+        ("analyse_output", [py, here + "/run_intermittent_failures_tests.py", "analyse_output",
+                            inputs["tests_file"], inputs["output_dir"]],
+         inputs["outputs"], inputs["output_dir"]),
+        ("scrape_logs", [py, scripts_dir + "/scrape_logs.py", inputs["crash_log"]],
+         inputs["blocks"], inputs["crash_log"]),
+        ("index_crashes", [py, scripts_dir + "/index_crashes.py", "build",
+                           inputs["work_dir"] + "/crashes.db", inputs["crash_log"]],
+         inputs["blocks"], inputs["crash_log"]),
+    ]
+
+
+def generate(work_dir, size, flaky, seed):
+    print("Generating inputs of size {} in {}".format(size, work_dir))
+    tests = max(1, size // reports)
+    output_tests = max(1, size // (10 * runs))
+    blocks = max(1, size // 10)
+
+    inputs = {"work_dir": work_dir,
+              "report_dir": work_dir + "/wptreport",
+              "output_dir": work_dir + "/outputs",
+              "tests_file": work_dir + "/tests.txt",
+              "crash_log": work_dir + "/crash.log",
+              "results": tests * reports,
+              "outputs": output_tests * runs,
+              "blocks": blocks}
+    synthetic.generate_reports(inputs["report_dir"], tests, reports, flaky, 5, seed)
+    synthetic.generate_outputs(inputs["output_dir"], inputs["tests_file"], output_tests, runs,
+                               flaky, seed)
+    synthetic.generate_crash_log(inputs["crash_log"], blocks, seed)
+    return inputs
+
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for (root, _, files) in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def measure(command):
+    """(seconds, peak RSS in KiB, returncode) of running `command`, output discarded."""
+    start = time.time()
+    rp = subprocess.Popen(command, cwd=here, stdout=subprocess.DEVNULL)
+    (_, status, rusage) = os.wait4(rp.pid, 0)
+    rp.returncode = os.waitstatus_to_exitcode(status)
+    return (time.time() - start, rusage.ru_maxrss, rp.returncode)
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_file):
+    if os.path.isfile(history_file):
+        return json.load(open(history_file))
+    return []
+
+
+def save_history(history_file, history):
+    with open(history_file + ".part", "w") as fout:
+        json.dump(history, fout, indent=1)
+    os.replace(history_file + ".part", history_file)
+
+
+def previous(history, analyser, size):
+    for entry in reversed(history):
+        if entry["analyser"] == analyser and entry["size"] == size:
+            return entry
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysers.")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma separated wptreport result counts.")
+    parser.add_argument("--flaky", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="Comma separated analysers to run.")
+    parser.add_argument("--history", default="benchmark_history.json")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated inputs.")
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    rev = revision()
+    only = None if args.only is None else args.only.split(",")
+
+    print("ANALYSER, SIZE, ITEMS, SECONDS, ITEMS_PER_SECOND, MAX_RSS_KIB, VS_LAST")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        work_dir = tempfile.mkdtemp(prefix="benchmark-")
+        try:
+            inputs = generate(work_dir, size, args.flaky, args.seed)
+            for (name, command, items, input_path) in analysers(inputs):
+                if only is not None and name not in only:
+                    continue
+                (seconds, max_rss, returncode) = measure(command)
+                if returncode != 0:
+                    print("{} exited with {}, not recording it.".format(name, returncode))
+                    continue
+
+                entry = {"analyser": name, "size": size, "items": items,
+                         "input_bytes": disk_size(input_path), "seconds": seconds,
+                         "items_per_second": items / seconds, "max_rss_kib": max_rss,
+                         "revision": rev, "time": time.time()}
+                last = previous(history, name, size)
+                vs_last = "" if last is None else "{:.2f}x".format(seconds / last["seconds"])
+                history.append(entry)
+                print("{}, {}, {}, {:.3f}, {:.0f}, {}, {}".format(
+                    name, size, items, seconds, entry["items_per_second"], max_rss, vs_last))
+        finally:
+            if args.keep:
+                print("Inputs kept in", work_dir)
+            else:
+                shutil.rmtree(work_dir)
+
+    save_history(args.history, history)
+
+
+if __name__ == "__main__":
+    main()
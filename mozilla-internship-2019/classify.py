@@ -0,0 +1,114 @@
+'''
+Status of a run from mach's output, worked out line by line while the output is captured
+so the runner knows it the moment the run exits. Gives the same answer as
+run_intermittent_failures_tests.analyse_file, which reads the whole output file:
+
+- "ERROR Unable to find any tests at the path" on the second line: DOES_NOT_EXIST
+- the third line from the end is "OK": SUCCEEDED
+- or is "TIMEOUT <test>": TIMEDOUT
+- anything else: FAILED
+
+It also notes whether a "▶ CRASH" block went by.
+
+Every phase of experiment.py writes a json line per run to its `status_file`, which
+`analyse_output` uses instead of reading the outputs.
+'''
+
+import json
+import os
+from collections import deque
+from enum import Enum
+
+from wptreport import status_file
+
+
+class TestStatus(Enum):
+    DOES_NOT_EXIST = 1
+    FAILED = 2
+    SUCCEEDED = 3
+    # The servo test returned with timeout.
+    TIMEDOUT = 4
+    # Didn't look like a regular fail.
+    UNKNOWN = 5
+
+
+class Classifier:
+    """Fed a run's output in chunks, as it comes."""
+
+    def __init__(self, test_name):
+        self.test_name = test_name.encode('utf-8')
+        self.partial = b""
+        self.lines = 0
+        self.does_not_exist = False
+        self.crashed = False
+        # Last three lines which have something after them but whitespace, and the
+        # whitespace only lines since. The output is rstrip()ed before looking at its end.
+        self.tail = deque(maxlen=3)
+        self.blank = deque(maxlen=3)
+
+    def update(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.line(line)
+
+    def line(self, line):
+        if self.lines == 1 and b"ERROR Unable to find any tests at the path" in line:
+            self.does_not_exist = True
+        if line.startswith("  ▶ CRASH".encode('utf-8')):
+            self.crashed = True
+        self.lines += 1
+
+        if line.strip() == b"":
+            self.blank.append(line)
+        else:
+            self.tail.extend(self.blank)
+            self.blank.clear()
+            self.tail.append(line)
+
+    def status(self):
+        """Status of the run, once all of its output has been fed."""
+        if self.partial != b"":
+            self.line(self.partial)
+            self.partial = b""
+
+        if self.lines < 3 or len(self.tail) < 3:
+            return TestStatus.UNKNOWN
+        if self.does_not_exist:
+            return TestStatus.DOES_NOT_EXIST
+
+        result_line = self.tail[0].strip()
+        if result_line == b"OK":
+            return TestStatus.SUCCEEDED
+        elif result_line == b"TIMEOUT " + self.test_name:
+            return TestStatus.TIMEDOUT
+        # analyse_file counts everything else as a fail too.
+        return TestStatus.FAILED
+
+
+def classify(test_name, contents):
+    classifier = Classifier(test_name)
+    classifier.update(contents)
+    return (classifier.status(), classifier.crashed)
+
+
+def write_status(fout, test_name, test_num, mode, status, crashed):
+    fout.write(json.dumps({"test": test_name, "run": test_num, "mode": mode,
+                           "status": status.name, "crash": crashed}) + "\n")
+    fout.flush()
+
+
+def read_statuses(output_dir):
+    """(test, run) -> TestStatus of every run in the status file. Empty if there is none."""
+    statuses = {}
+    path = output_dir + "/" + status_file
+    if not os.path.isfile(path):
+        return statuses
+    for line in open(path):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # Torn last line from a crash, that run gets analysed from its output.
+            continue
+        statuses[(entry["test"], entry["run"])] = TestStatus[entry["status"]]
+    return statuses
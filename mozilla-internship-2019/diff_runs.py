@@ -0,0 +1,243 @@
+'''
+Diff two sets of runs, e.g. a baseline run against an rr replay run.
+
+Each directory is either a directory of --log-wptreport json files or an output
+directory produced by run_intermittent_failures_tests.py (what `analyse_output` reads).
+Both sides are reduced to per test summaries sorted by test name and merge-joined, so
+at most one report, plus one line per report file, is held in memory at a time.
+
+Only tests whose status distribution or average duration changed beyond the given
+thresholds are printed.
+'''
+
+import argparse
+import heapq
+import os
+import sys
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+import classify
+import packs
+import run_intermittent_failures_tests as runner
+import wptreport
+
+usage = """\
+Usage: python3 diff_runs.py [options] tests_file|all dir_a/ dir_b/
+
+If "all" is given, every test found in the wptreport files is compared. Output
+directories from run_intermittent_failures_tests.py always need a tests_file, as test
+names cannot be recovered from their output file names.\
+"""
+
+
+class Summary:
+    """All runs of a single test on one side of the diff."""
+    name = ""
+    total = 0
+    # Status name -> number of runs with that status.
+    statuses = {}
+    duration_total = 0
+    # Runs with a known duration. Output directories don't record one.
+    duration_runs = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.statuses = {}
+
+    def add(self, status, duration=None):
+        self.total += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if duration is not None:
+            self.duration_total += duration
+            self.duration_runs += 1
+
+    def fraction(self, status):
+        return self.statuses.get(status, 0) / self.total
+
+    def average_duration(self):
+        if self.duration_runs == 0:
+            return None
+        return self.duration_total / self.duration_runs
+
+    def distribution(self):
+        return " ".join("{}:{}".format(s, n) for (s, n) in sorted(self.statuses.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage)
+    parser.add_argument("tests")
+    parser.add_argument("dir_a")
+    parser.add_argument("dir_b")
+    parser.add_argument("--status-threshold", type=float, default=0.1,
+                        help="Report a test if the fraction of runs with some status "
+                             "moved by at least this much. Default: 0.1")
+    parser.add_argument("--duration-threshold", type=float, default=0.25,
+                        help="Report a test if its average duration changed by at least "
+                             "this fraction. Default: 0.25")
+    args = parser.parse_args()
+
+    tests = None
+    if args.tests != "all":
+        tests = []
+        for line in open(args.tests):
+            line = line.strip()
+            if line != "" and not line.startswith("#"):
+                tests.append(line)
+
+    for d in [args.dir_a, args.dir_b]:
+        if not os.path.isdir(d):
+            print(d + " is not a dir")
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summaries_a = summaries(args.dir_a, tests, tmp_dir + "/a")
+        summaries_b = summaries(args.dir_b, tests, tmp_dir + "/b")
+
+        print("NAME, CHANGE, A, B, A_DURATION, B_DURATION")
+        changed = 0
+        for (name, a, b) in merge_join(summaries_a, summaries_b):
+            reasons = changes(a, b, args.status_threshold, args.duration_threshold)
+            if reasons == []:
+                continue
+            changed += 1
+            print("{}, {}, {}, {}, {}, {}".format(
+                name, ";".join(reasons),
+                "" if a is None else a.distribution(),
+                "" if b is None else b.distribution(),
+                format_duration(a), format_duration(b)))
+
+    print("{} tests changed.".format(changed), file=sys.stderr)
+
+
+def summaries(directory, tests, tmp_dir):
+    """Sorted stream of Summary for either kind of result directory."""
+    if wptreport.is_wptreport_dir(directory):
+        os.mkdir(tmp_dir)
+        return wptreport_summaries(directory, tests, tmp_dir)
+
+    if tests is None:
+        print(directory + " is not a wptreport dir. Output dirs need a tests_file.")
+        sys.exit(1)
+    return output_summaries(directory, tests)
+
+
+def wptreport_summaries(report_dir, tests, tmp_dir):
+    """
+    Write every report as a run file of (test, status, duration) lines sorted by test
+    name, then stream a k-way merge of the run files grouped by test.
+    """
+    tests = None if tests is None else set(tests)
+    run_files = []
+
+    for (i, json_file) in enumerate(wptreport.report_files(report_dir)):
+        rows = []
+        for result in wptreport.load_results(json_file):
+            if tests is not None and result["test"] not in tests:
+                continue
+            rows.append((result["test"], result["status"], result["duration"]))
+        rows.sort()
+
+        run_file = tmp_dir + "/" + str(i)
+        with open(run_file, "w") as fout:
+            for (name, status, duration) in rows:
+                fout.write("{}\t{}\t{}\n".format(name, status, duration))
+        run_files.append(run_file)
+
+    streams = [read_run_file(f) for f in run_files]
+    for (name, rows) in groupby(heapq.merge(*streams), key=itemgetter(0)):
+        summary = Summary(name)
+        for (_, status, duration) in rows:
+            summary.add(status, duration)
+        yield summary
+
+
+def read_run_file(run_file):
+    with open(run_file) as fin:
+        for line in fin:
+            (name, status, duration) = line.rstrip("\n").split("\t")
+            yield (name, status, int(duration))
+
+
+def output_summaries(output_dir, tests):
+    """Same classification as `analyse_output`, one test at a time in sorted order."""
+    timeouts = set()
+    timeout_file = output_dir + "/" + wptreport.timeout_file
+    if os.path.isfile(timeout_file):
+        for line in open(timeout_file):
+            timeouts.add(line.rstrip())
+    hangs = runner.read_hangs(output_dir)
+    statuses = classify.read_statuses(output_dir)
+
+    outputs = packs.Outputs(output_dir)
+    for test in sorted(set(tests)):
+        summary = Summary(test)
+
+        for i in range(0, runner.test_runs):
+            read_file = output_dir + "/" + test.replace('/', '_') + str(i)
+            name = test.replace('/', '_') + str(i)
+            if name not in outputs:
+                continue
+
+            if test + str(i) in timeouts:
+                summary.add("RIG_TIMEOUT")
+            elif test + str(i) in hangs:
+                summary.add("HANG")
+            elif (test, i) in statuses:
+                summary.add(statuses[(test, i)].name)
+            else:
+                summary.add(runner.analyse_contents(test, outputs.read(name), read_file).name)
+
+        if summary.total != 0:
+            yield summary
+
+
+def merge_join(summaries_a, summaries_b):
+    """Join two streams sorted by name. Yields (name, a, b), a or b is None if missing."""
+    a = next(summaries_a, None)
+    b = next(summaries_b, None)
+
+    while a is not None or b is not None:
+        if b is None or (a is not None and a.name < b.name):
+            yield (a.name, a, None)
+            a = next(summaries_a, None)
+        elif a is None or b.name < a.name:
+            yield (b.name, None, b)
+            b = next(summaries_b, None)
+        else:
+            yield (a.name, a, b)
+            a = next(summaries_a, None)
+            b = next(summaries_b, None)
+
+
+def changes(a, b, status_threshold, duration_threshold):
+    """Reasons why this test is considered changed. Empty if it isn't."""
+    if a is None:
+        return ["only_in_b"]
+    if b is None:
+        return ["only_in_a"]
+
+    reasons = []
+    for status in set(a.statuses) | set(b.statuses):
+        if abs(a.fraction(status) - b.fraction(status)) >= status_threshold:
+            reasons.append("status")
+            break
+
+    duration_a = a.average_duration()
+    duration_b = b.average_duration()
+    if duration_a is not None and duration_b is not None and duration_a > 0:
+        if abs(duration_b - duration_a) / duration_a >= duration_threshold:
+            reasons.append("duration")
+
+    return reasons
+
+
+def format_duration(summary):
+    if summary is None or summary.average_duration() is None:
+        return ""
+    return "{:.0f}".format(summary.average_duration())
+
+
+if __name__ == "__main__":
+    main()
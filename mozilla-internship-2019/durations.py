@@ -0,0 +1,194 @@
+'''
+Historical test durations, used to schedule long tests first and to split a test list
+into shards of equal expected runtime for bulk runs:
+
+./mach test-wpt --headless --release --log-wptreport ../results/shard0.json $(cat shard0.txt)
+
+History comes from directories of --log-wptreport json files (their `duration`) or
+from output dirs of run_intermittent_failures_tests.py / experiment.py (the wall time
+in their `rusage_file`). The two are kept apart: a wptreport duration only times the
+test itself, a wall the whole `mach test-wpt` run, mach and wptserve starting up and
+shutting down included. Durations of a whole run are a test's walls if it has any, else
+its wptreport durations plus that startup, learned from the tests which have both or
+`startup` seconds. A test's expected duration is the median of those. Tests without
+history are assumed to take the median of all tests.
+
+AdaptiveTimeouts turns the same history into a timeout per test and mode: a high quantile
+of the durations of the test's whole runs, times the mode's rr overhead, times a safety
+margin, clamped between a floor and a ceiling. A 250 ms test which hangs is then killed
+well before 30 s, and an 8 s test isn't cut off when rr makes it take a minute.
+'''
+
+import heapq
+import json
+import os
+import sys
+
+import wptreport
+from wptreport import read_tests, rusage_file
+
+usage = """\
+Usage: python3 durations.py order tests_file history_dir/...
+                            shard tests_file n_shards out_prefix history_dir/...
+
+order: Print the tests in tests_file longest first.
+
+shard: Split tests_file into n_shards files out_prefix0.txt ... of about equal expected
+       runtime (longest processing time first bin-packing).\
+"""
+
+# Seconds a `mach test-wpt` run takes besides the test: mach, wptserve and the browser
+# starting up and shutting down. Only used when no test has both a wptreport duration and
+# a wall to learn it from.
+startup = 5
+
+# Settings of AdaptiveTimeouts. Times in seconds. The overheads are how much longer than
+# a baseline run a record or replay run takes, report/timing_results_to_graph.txt has a
+# median replay overhead of about 8.
+adaptive_defaults = {
+    "quantile": 0.95,
+    "margin": 3,
+    "floor": 5,
+    "ceiling": 120,
+    "overhead": {"baseline": 1, "record": 8, "replay": 8},
+}
+
+
+class History:
+    """Expected duration, in ms, of a whole run of every test."""
+
+    def __init__(self, durations, walls=None):
+        # test -> sorted list of ms, of the test alone (wptreport) and of whole runs.
+        self.durations = {test: sorted(d) for (test, d) in durations.items() if d != []}
+        self.walls = {test: sorted(w) for (test, w) in (walls or {}).items() if w != []}
+        # ms a run takes on top of its test.
+        overheads = [median(self.walls[test]) - median(self.durations[test])
+                     for test in self.walls if test in self.durations]
+        self.startup = max(0, median(overheads)) if overheads != [] else startup * 1000
+        self.estimates = {test: median(self.runs(test))
+                          for test in self.durations.keys() | self.walls.keys()}
+        self.default = median(list(self.estimates.values())) if self.estimates else 0
+
+    def runs(self, test):
+        """Sorted durations of whole runs of `test`, [] without history."""
+        if test in self.walls:
+            return self.walls[test]
+        return [d + self.startup for d in self.durations.get(test, [])]
+
+    def expected(self, test):
+        return self.estimates.get(test, self.default)
+
+    def quantile(self, test, q):
+        """Nearest rank `q` quantile of the test's whole runs. None without history."""
+        d = self.runs(test)
+        if d == []:
+            return None
+        return d[min(len(d) - 1, int(q * len(d)))]
+
+
+class AdaptiveTimeouts:
+    """Timeouts, in seconds, per test and mode from a History. See adaptive_defaults."""
+
+    def __init__(self, history, settings=None):
+        self.history = history
+        self.settings = dict(adaptive_defaults)
+        self.settings.update(settings or {})
+        self.overhead = dict(adaptive_defaults["overhead"])
+        self.overhead.update(self.settings["overhead"])
+
+    def timeout(self, test, mode, fallback):
+        """Timeout of a `mode` run of `test`, `fallback` if it has no history."""
+        duration = self.history.quantile(test, self.settings["quantile"])
+        if duration is None:
+            return fallback
+        timeout = duration / 1000 * self.overhead[mode] * self.settings["margin"]
+        return min(max(timeout, self.settings["floor"]), self.settings["ceiling"])
+
+
+def load_history(dirs, overhead=None):
+    """
+    History of the tests in `dirs`. Given `overhead` (mode -> factor), record and replay
+    durations from rusage files are scaled back down to baseline durations.
+    """
+    durations = {}
+    walls = {}
+    for d in dirs:
+        if wptreport.is_wptreport_dir(d):
+            for json_file in wptreport.report_files(d):
+                for result in wptreport.load_results(json_file):
+                    durations.setdefault(result["test"], []).append(result["duration"])
+        elif os.path.isfile(d + "/" + rusage_file):
+            for line in open(d + "/" + rusage_file):
+                entry = json.loads(line)
+                # Killed by the rig, that is the timeout rather than the test's duration.
+                if entry["returncode"] is None:
+                    continue
+                wall = entry["wall"] * 1000
+                if overhead is not None:
+                    wall /= overhead.get(entry["mode"], 1)
+                walls.setdefault(entry["test"], []).append(wall)
+        else:
+            print("No wptreport files or {} in {}. Ignoring it.".format(rusage_file, d))
+    return History(durations, walls)
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2 == 1:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+def longest_first(items, history, test_of=lambda item: item):
+    """`items` sorted by the expected duration of their test, longest first. Stable."""
+    return sorted(items, key=lambda item: -history.expected(test_of(item)))
+
+
+def shard(tests, n, history):
+    """
+    Split `tests` into `n` lists of about equal expected runtime: give each test, longest
+    first, to the shard with the least expected runtime so far. Returns
+    [(expected runtime, tests)].
+    """
+    shards = [(0, i, []) for i in range(n)]
+    heapq.heapify(shards)
+    for test in longest_first(tests, history):
+        (runtime, i, shard_tests) = heapq.heappop(shards)
+        shard_tests.append(test)
+        heapq.heappush(shards, (runtime + history.expected(test), i, shard_tests))
+    shards.sort(key=lambda s: s[1])
+    return [(runtime, shard_tests) for (runtime, _, shard_tests) in shards]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    tests = read_tests(sys.argv[2])
+
+    if command == "order":
+        history = load_history(sys.argv[3:])
+        for test in longest_first(tests, history):
+            print(test)
+    elif command == "shard" and len(sys.argv) >= 5:
+        n = int(sys.argv[3])
+        out_prefix = sys.argv[4]
+        history = load_history(sys.argv[5:])
+
+        for (i, (runtime, shard_tests)) in enumerate(shard(tests, n, history)):
+            shard_file = out_prefix + str(i) + ".txt"
+            with open(shard_file, "w") as fout:
+                for test in shard_tests:
+                    fout.write(test + "\n")
+            print("{}: {} tests, expected {:.1f}s".format(shard_file, len(shard_tests),
+                                                          runtime / 1000))
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,837 @@
+'''
+Run a whole experiment unattended from a json spec file. For example baseline, record and
+replay runs of the same tests:
+
+{
+    "output_dir": "../experiments/intermittents",
+    "concurrency": 4,
+    "env": {"RUST_BACKTRACE": "1"},
+    "phases": [
+        {"name": "baseline", "mode": "baseline", "tests": "interesting_intermittents.txt"},
+        {"name": "record", "mode": "record", "tests": "interesting_intermittents.txt",
+         "runs": 10},
+        {"name": "replay", "mode": "replay", "tests": "interesting_intermittents.txt",
+         "record": "record", "timeout": 60}
+    ]
+}
+
+Every phase writes to output_dir/name/ exactly what the mode of the same name in
+run_intermittent_failures_tests.py writes, so `analyse_output` and friends work on it
+unchanged. Optional keys, and their defaults, are in `defaults`; every phase may override
+"runs", "timeout" and "env", and may list phases it has to wait for in "after". "tests" is
+either a file with one test per line or a list of tests. Instead of "tests", "plan" names
+a plan written by plan_runs.py, which also gives every test its number of runs.
+
+The spec is compiled into a graph of jobs, one per (phase, test, run), each with its own
+immutable environment, and executed by a single Engine keeping `concurrency` jobs running
+across all phases. Record jobs retry up to "runs" times until the test records.
+
+Replay phases are pipelined: the replay runs of a test become ready as soon as that test's
+record job is done, and share the pool with the recordings still going on, so the whole
+experiment takes about max(record, replay) rather than their sum. Record jobs, including
+retries, go first so they keep unlocking replays. Set "pipeline": false on a replay phase
+to wait for its whole record phase instead.
+
+With "history", a list of wptreport or output dirs from earlier experiments, jobs are
+scheduled longest expected test first (record jobs still go first), so that a long test
+doesn't start last and stretch the tail of the experiment. See durations.py.
+
+With "adaptive_timeout" as well, true or a dict overriding durations.adaptive_defaults,
+every job gets a timeout derived from its test's durations and its mode instead of its
+phase's fixed one. Tests without history keep the phase's timeout.
+
+Jobs' output is read through a pipe as it comes, and classified on the way, see
+classify.py. With "inactivity_timeout", a job which
+prints nothing for that many seconds, e.g. a deadlocked Servo, is killed right away
+instead of at its timeout, and listed in its phase's hang_file rather than timeout_file.
+
+With "cpu_affinity", every slot of the pool is pinned to its own CPUs, so concurrent
+jobs don't compete for cores and rr's timings stay comparable between runs; "nice" and
+"ionice" lower the jobs' CPU and IO priority. Phases may override all three. The slot and
+CPUs of every run are in its journal start entry.
+
+With "manifests", WPT MANIFEST.json files, tests which no longer exist are dropped from
+every phase before anything runs and listed in its tests_that_no_longer_exist.txt.
+
+Each phase keeps a write-ahead journal of job starts and finishes. Outputs, .record and
+.record_fail files are written under a ".part" name and renamed into place once their
+job is done, and only then is the job journaled as finished. An experiment that crashed or
+was interrupted resumes exactly the jobs with no finish record, whatever half written
+files they left behind. Output dirs from before the journal existed fall back to
+skipping jobs whose output files exist, which are then journaled as finished.
+
+With "raw_log", mach also writes its raw structured log for every run, from which the
+run's status is taken instead of from the text output; it is kept as the output's name +
+".mozlog". See rawlog.py.
+
+Every run's output is also fingerprinted, see fingerprint.py, to check whether replays
+reproduce their recording.
+
+Outputs go to a pack file per phase, storing identical outputs once, unless "pack" is
+false for the spec or phase. Everything reading outputs goes through packs.Outputs, which
+reads packed and loose outputs alike.
+'''
+
+import json
+import os
+import resource
+import select
+import shutil
+import subprocess
+import sys
+import time
+from collections import deque
+from types import MappingProxyType
+
+import classify
+import durations
+import fingerprint
+import job_control
+import packs
+import plan_runs
+import rawlog
+import wpt_manifest
+from telemetry import Telemetry
+from wptreport import (fingerprint_file, hang_file, journal_file, part_suffix, read_tests,
+                       rusage_file, status_file, telemetry_events_file, telemetry_textfile,
+                       timeout_file, write_atomically)
+
+usage = """\
+Usage: python3 experiment.py spec.json\
+"""
+
+modes = ["baseline", "record", "replay"]
+
+defaults = {
+    "mach_command": "./mach test-wpt --headless --release ",
+    "concurrency": 1,
+    "runs": 100,
+    # Seconds, per mode.
+    "timeout": {"baseline": 30, "record": 20, "replay": 30},
+    "env": {},
+    # Dirs with durations of earlier runs, to schedule the longest tests first.
+    "history": [],
+    # Per test timeouts from "history". See durations.AdaptiveTimeouts.
+    "adaptive_timeout": False,
+    # Seconds a job may go without printing anything before it is killed as hung. None
+    # to only rely on "timeout". Must be longer than the slowest test's silence.
+    "inactivity_timeout": None,
+    # WPT MANIFEST.json files. If given, tests in none of them are dropped before
+    # anything runs. See wpt_manifest.py.
+    "manifests": [],
+    # Keep outputs in a pack file per phase. See packs.py.
+    "pack": True,
+    # Have mach write a raw structured log per run, and classify runs from it. See
+    # rawlog.py.
+    "raw_log": False,
+    # Pin every slot to its own CPUs: true to split the CPUs we may use evenly between
+    # slots, or a list of CPU lists, one per slot.
+    "cpu_affinity": False,
+    # Niceness, and ionice [class, level], of every job. None to inherit ours.
+    "nice": None,
+    "ionice": None,
+    "telemetry_events_file": telemetry_events_file,
+    "telemetry_textfile": telemetry_textfile,
+    "telemetry_interval": 15,
+}
+
+# Environment variables telling the rr channels what to do. Never inherited by a job.
+rr_env = ["RR_CHANNEL", "RR_RECORD_FILE"]
+
+
+class Phase:
+    """All runs of one mode over a list of tests, writing to its own output dir."""
+
+    def __init__(self, name, mode, tests, runs, timeout, output_dir, env=None,
+                 record_dir=None, after=None, record_phase=None, pipeline=False,
+                 pack_outputs=False, inactivity_timeout=None, raw_log=False, test_runs=None,
+                 cpu_affinity=False, nice=None, ionice=None):
+        self.name = name
+        self.mode = mode
+        self.tests = tests
+        # For record phases, the number of attempts to record each test.
+        self.runs = runs
+        # Test -> runs, for tests with their own number of runs. See plan_runs.py.
+        self.test_runs = {} if test_runs is None else test_runs
+        self.timeout = timeout
+        self.output_dir = output_dir
+        self.env = {} if env is None else env
+        # Where the .record files of a replay phase come from.
+        self.record_dir = record_dir
+        # Names of phases which have to finish before this one starts.
+        self.after = [] if after is None else after
+        # Name of the record phase producing `record_dir`. If `pipeline`, each test is
+        # replayed as soon as it has been recorded instead of waiting for the whole phase.
+        self.record_phase = record_phase
+        self.pipeline = pipeline
+        # Append outputs to the phase's pack instead of one file each. See packs.py.
+        self.pack_outputs = pack_outputs
+        # Seconds without output after which a job is killed as hung. None for never.
+        self.inactivity_timeout = inactivity_timeout
+        # Pass --log-raw to mach and take runs' statuses from it. See rawlog.py.
+        self.raw_log = raw_log
+        # "cpu_affinity" of the slots running the phase's jobs, and the jobs' niceness and
+        # ionice (class, level). None to inherit ours.
+        self.cpu_affinity = cpu_affinity
+        self.nice = nice
+        self.ionice = ionice
+
+        self.pack = None
+        self.fout_timeout = None
+        self.fout_hang = None
+        self.fout_rusage = None
+        self.fout_fingerprints = None
+        self.fout_status = None
+        self.fout_journal = None
+        # (test, run) of every job the journal says is finished.
+        self.finished = set()
+        # No journal yet, the output dir predates it or is new.
+        self.legacy = False
+
+    def runs_of(self, test):
+        return self.test_runs.get(test, self.runs)
+
+    def open(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.fout_timeout = open(self.output_dir + "/" + timeout_file, "a")
+        self.fout_hang = open(self.output_dir + "/" + hang_file, "a")
+        self.fout_rusage = open(self.output_dir + "/" + rusage_file, "a")
+        self.fout_fingerprints = open(self.output_dir + "/" + fingerprint_file, "a")
+        self.fout_status = open(self.output_dir + "/" + status_file, "a")
+        if self.pack_outputs:
+            self.pack = packs.Pack(self.output_dir)
+
+        journal = self.output_dir + "/" + journal_file
+        self.legacy = not os.path.isfile(journal)
+        self.finished = set()
+        if not self.legacy:
+            for line in open(journal):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash, that job never finished.
+                    continue
+                if entry["event"] == "finish":
+                    self.finished.add((entry["test"], entry["run"]))
+        self.fout_journal = open(journal, "a")
+
+    def journal(self, event, job, **fields):
+        fields["event"] = event
+        fields["test"] = job.test
+        fields["run"] = job.run
+        fields["time"] = time.time()
+        self.fout_journal.write(json.dumps(fields) + "\n")
+        self.fout_journal.flush()
+        # Outputs were renamed into place before a finish, make sure that sticks.
+        if event == "finish":
+            os.fsync(self.fout_journal.fileno())
+
+    def close(self):
+        self.fout_timeout.close()
+        self.fout_hang.close()
+        self.fout_rusage.close()
+        self.fout_fingerprints.close()
+        self.fout_status.close()
+        self.fout_journal.close()
+        if self.pack is not None:
+            self.pack.close()
+
+
+class Job:
+    """A single run of a test. Record jobs are retried up to `phase.runs` times."""
+
+    def __init__(self, phase, test, run, command, base_env):
+        self.phase = phase
+        self.test = test
+        self.run = run
+        self.command = command
+        # Keys of the jobs or ("phase", name) this job has to wait for.
+        self.deps = []
+        self.attempt = 0
+        # Seconds.
+        self.timeout = phase.timeout
+        # job_control.Kill while the job is being killed, and whether it was for hanging.
+        self.kill = None
+        self.hung = False
+
+        prefix = phase.output_dir + "/" + test.replace('/', '_')
+        env = dict(base_env)
+        for var in rr_env:
+            env.pop(var, None)
+        env.update(phase.env)
+
+        if phase.mode == "record":
+            self.write_file = prefix
+            self.record_file = prefix + ".record"
+            self.record_fail_file = prefix + ".record_fail"
+            env["RR_CHANNEL"] = "record"
+            env["RR_RECORD_FILE"] = self.record_file + part_suffix
+        else:
+            self.write_file = prefix + str(run)
+
+        self.raw_log_file = None
+        if phase.raw_log:
+            self.raw_log_file = self.write_file + rawlog.suffix
+            self.command += " --log-raw " + self.raw_log_file + part_suffix
+
+        if phase.mode == "replay":
+            record_prefix = phase.record_dir + "/" + test.replace('/', '_')
+            self.record_file = record_prefix + ".record"
+            self.record_fail_file = record_prefix + ".record_fail"
+            env["RR_CHANNEL"] = "replay"
+            env["RR_RECORD_FILE"] = self.record_file
+
+        self.env = MappingProxyType(env)
+
+    @property
+    def key(self):
+        return (self.phase.name, self.test, self.run)
+
+    @property
+    def mode(self):
+        return self.phase.mode
+
+    def done(self):
+        """A previous run of the experiment already finished this job."""
+        if (self.test, self.run) in self.phase.finished:
+            return True
+        if not self.phase.legacy:
+            return False
+        if self.mode == "record":
+            return os.path.isfile(self.record_file) or os.path.isfile(self.record_fail_file)
+        return os.path.isfile(self.write_file)
+
+
+def compile_jobs(phases, mach_command, base_env):
+    """One Job per (phase, test, run), in phase then test order."""
+    base_env = dict(base_env)
+    recorded = {p.name: set(p.tests) for p in phases if p.mode == "record"}
+    jobs = []
+    for phase in phases:
+        for test in phase.tests:
+            runs = [0] if phase.mode == "record" else range(0, phase.runs_of(test))
+            for run in runs:
+                job = Job(phase, test, run, mach_command + test, base_env)
+                job.deps = [("phase", name) for name in phase.after]
+                # Tests the record phase doesn't know about get skipped when they start.
+                if phase.pipeline and test in recorded.get(phase.record_phase, set()):
+                    job.deps.append((phase.record_phase, test, 0))
+                jobs.append(job)
+    return jobs
+
+
+def set_timeouts(jobs, history, settings):
+    """Adaptive timeouts for `jobs`. `settings` as in durations.adaptive_defaults."""
+    timeouts = durations.AdaptiveTimeouts(history, settings)
+    for job in jobs:
+        job.timeout = timeouts.timeout(job.test, job.mode, job.phase.timeout)
+
+
+def adaptive_settings(spec):
+    """The spec's "adaptive_timeout" as settings for AdaptiveTimeouts, None if off."""
+    adaptive = spec["adaptive_timeout"]
+    if adaptive is False or adaptive is None:
+        return None
+    return {} if adaptive is True else adaptive
+
+
+def load_history(spec):
+    """History of the spec, record and replay durations scaled to baseline ones."""
+    settings = adaptive_settings(spec)
+    overhead = None
+    if settings is not None:
+        overhead = dict(durations.adaptive_defaults["overhead"])
+        overhead.update(settings.get("overhead", {}))
+    return durations.load_history(spec["history"], overhead)
+
+
+def order_jobs(jobs, history):
+    """Record jobs first since replays wait on them, then longest expected test first."""
+    return sorted(jobs, key=lambda job: (job.mode != "record", -history.expected(job.test)))
+
+
+class Capture:
+    """
+    A job's stdout, read through a non-blocking pipe as it comes, written to its output
+    file, fingerprinted and classified on the way.
+    """
+
+    def __init__(self, pipe, fout, test):
+        self.pipe = pipe
+        os.set_blocking(pipe.fileno(), False)
+        self.fout = fout
+        self.fingerprint = fingerprint.Fingerprint()
+        self.classifier = classify.Classifier(test)
+        self.last_output = time.time()
+        # The job closed its end of the pipe, nothing to wait for in select any more.
+        self.eof = False
+
+    def fileno(self):
+        return self.pipe.fileno()
+
+    def read(self):
+        """Everything available right now. False once the job closed its end."""
+        while True:
+            try:
+                data = os.read(self.pipe.fileno(), 1 << 16)
+            except BlockingIOError:
+                return True
+            if data == b"":
+                self.eof = True
+                return False
+            self.fout.write(data)
+            self.fingerprint.update(data)
+            self.classifier.update(data)
+            self.last_output = time.time()
+
+    def silence(self):
+        return time.time() - self.last_output
+
+    def close(self):
+        # The job's process group is gone, so this only drains what is left in the pipe.
+        self.read()
+        self.pipe.close()
+        self.fout.close()
+
+
+class Engine:
+    """
+    Runs a graph of jobs, keeping up to `concurrency` of them running at a time. A job
+    becomes ready once every job, or phase, in its deps is complete.
+
+    With `more`, whenever a slot is free and no job is ready, `more(free slots)` is asked
+    for new jobs to add, [] if there are none right now and None once there will be none.
+    `done` is called with every job once it is complete.
+    """
+
+    def __init__(self, phases, jobs, concurrency, telemetry, marker_dir, more=None,
+                 done=None):
+        self.phases = []
+        self.concurrency = concurrency
+        self.telemetry = telemetry
+        self.marker_dir = marker_dir
+        self.more = more
+        self.done = done
+        self.free_slots = list(range(concurrency))
+        self.opened = False
+        # Phase name -> slot -> CPUs its jobs are pinned to, None not to pin them.
+        self.cpu_sets = {}
+
+        # Jobs of a phase not complete yet.
+        self.remaining = {}
+        # Key -> jobs waiting on it, and job -> number of deps not complete yet.
+        self.dependents = {}
+        self.waiting = {}
+        self.ready = deque()
+        self.blocked = 0
+        # (job, Popen, Capture, spawn start, slot)
+        self.running = []
+        # Job key -> `rusage_file` entry of its last run.
+        self.results = {}
+
+        for phase in phases:
+            self.add_phase(phase)
+        self.add(jobs)
+
+    def add_phase(self, phase):
+        self.phases.append(phase)
+        self.remaining[phase.name] = 0
+        self.cpu_sets[phase.name] = slot_cpu_sets(phase.cpu_affinity, self.concurrency)
+        if self.opened:
+            phase.open()
+
+    def add(self, jobs):
+        """Add jobs, of phases given to the engine or new ones, even while it runs."""
+        ready = len(self.ready)
+        for job in jobs:
+            if job.phase.name not in self.remaining:
+                self.add_phase(job.phase)
+            self.remaining[job.phase.name] += 1
+
+            self.waiting[job] = len(job.deps)
+            for dep in job.deps:
+                self.dependents.setdefault(dep, []).append(job)
+            if len(job.deps) == 0:
+                self.ready.append(job)
+            else:
+                self.blocked += 1
+        if self.opened:
+            self.telemetry.set_queue_depth(self.telemetry.queue_depth + len(self.ready) - ready)
+
+    def run(self):
+        for phase in self.phases:
+            phase.open()
+        self.opened = True
+        self.telemetry.set_queue_depth(len(self.ready) + self.blocked)
+        for phase in self.phases:
+            if self.remaining[phase.name] == 0:
+                self.release(("phase", phase.name))
+
+        while True:
+            if self.more is not None and len(self.ready) == 0 \
+                    and len(self.running) < self.concurrency:
+                jobs = self.more(self.concurrency - len(self.running))
+                if jobs is None:
+                    self.more = None
+                else:
+                    self.add(jobs)
+            if len(self.ready) == 0 and len(self.running) == 0 and self.more is None:
+                break
+
+            while len(self.ready) != 0 and len(self.running) < self.concurrency:
+                self.start(self.ready.popleft())
+            self.poll()
+            # Sleep until there is output to capture, or for a short while to check exits,
+            # timeouts and for more jobs.
+            select.select([capture for (_, _, capture, _, _) in self.running
+                           if not capture.eof], [], [], 0.05)
+
+        if self.blocked != 0:
+            print("{} jobs never became ready. Check the phases' dependencies.".format(
+                self.blocked))
+        for phase in self.phases:
+            phase.close()
+
+    def start(self, job):
+        if job.done() and job.attempt == 0:
+            print("Output file! {} Skipping.".format(job.write_file))
+            if job.phase.legacy:
+                # Finished before the journal existed. Journal it, the next run of the
+                # experiment only goes by the journal.
+                job.phase.journal("finish", job, legacy=True)
+            self.skip(job)
+            return
+
+        if job.mode == "replay" and not os.path.isfile(job.record_file) \
+                and not os.path.isfile(job.record_fail_file):
+            print("Record files do not exist for {}. Skipping".format(job.test))
+            # Not finished, a later run of the experiment may have the recording.
+            job.phase.journal("skip", job)
+            self.skip(job)
+            return
+
+        job.kill = None
+        job.hung = False
+        slot = self.free_slots.pop(0)
+        phase = job.phase
+        cpu_sets = self.cpu_sets[phase.name]
+        cpus = None if cpu_sets is None else cpu_sets[slot]
+        phase.journal("start", job, attempt=job.attempt, timeout=job.timeout, slot=slot,
+                      cpus=None if cpus is None else sorted(cpus), nice=phase.nice,
+                      ionice=phase.ionice)
+        fout = open(job.write_file + part_suffix, "wb")
+        if job.raw_log_file is not None:
+            # Left over by an interrupted run, mach may die before it writes a new one.
+            remove_file(job.raw_log_file + part_suffix)
+        print("Command: " + job.command)
+        spawn_start = time.time()
+        rp = job_control.spawn(job.command, subprocess.PIPE, job.env, self.marker_dir,
+                               cpus, phase.nice, phase.ionice)
+        self.telemetry.spawned(job.mode, job.test, job.run, time.time() - spawn_start)
+        self.running.append((job, rp, Capture(rp.stdout, fout, job.test), spawn_start, slot))
+
+    def skip(self, job):
+        self.telemetry.set_queue_depth(self.telemetry.queue_depth - 1)
+        self.complete(job)
+
+    def poll(self):
+        """
+        Capture the output of every running job, reap those which finished and start
+        killing those which ran past their timeout or went silent for longer than their
+        phase allows. Killing never blocks, a job keeps its slot until its process group
+        is gone.
+        """
+        for entry in list(self.running):
+            (job, rp, capture, spawn_start, slot) = entry
+            capture.read()
+
+            if job.kill is None:
+                rusage = job_control.try_reap(rp)
+                if rusage is None:
+                    if time.time() - spawn_start > job.timeout:
+                        job.kill = job_control.Kill(rp)
+                    elif job.phase.inactivity_timeout is not None \
+                            and capture.silence() > job.phase.inactivity_timeout:
+                        job.kill = job_control.Kill(rp)
+                        job.hung = True
+                    continue
+                wall = time.time() - spawn_start
+                job_control.finished(rp)
+                returncode = rp.returncode
+            else:
+                rusage = job.kill.poll()
+                if rusage is None:
+                    continue
+                wall = job.kill.reaped - spawn_start
+                returncode = None
+
+            self.running.remove(entry)
+            self.free_slots.append(slot)
+            capture.close()
+            self.finish(job, returncode, rusage, wall, capture, job.hung)
+
+    def keep_output(self, phase, path):
+        """Move the finished `path`.part into the phase's pack, or into place."""
+        if phase.pack is not None:
+            with open(path + part_suffix, "rb") as fin:
+                phase.pack.add(os.path.basename(path), fin.read())
+            os.remove(path + part_suffix)
+        else:
+            os.replace(path + part_suffix, path)
+
+    def finish(self, job, returncode, rusage, wall, capture, hung=False):
+        phase = job.phase
+        fingerprint.write_fingerprint(phase.fout_fingerprints, job.test, job.run, job.mode,
+                                      capture.fingerprint.hexdigest())
+        status = capture.classifier.status()
+        crashed = capture.classifier.crashed
+        if job.raw_log_file is not None and os.path.isfile(job.raw_log_file + part_suffix):
+            reader = rawlog.RunReader(job.test)
+            with open(job.raw_log_file + part_suffix, "rb") as fin:
+                reader.feed(fin)
+            (status, crashed) = (reader.status(), reader.crashed)
+            self.keep_output(phase, job.raw_log_file)
+        classify.write_status(phase.fout_status, job.test, job.run, job.mode, status, crashed)
+        self.keep_output(phase, job.write_file)
+        self.results[job.key] = write_rusage(phase.fout_rusage, job.test, job.run, job.mode,
+                                             returncode, wall, rusage)
+        self.telemetry.finished(job.mode, job.test, job.run, wall, returncode, hung)
+
+        if job.mode != "record":
+            if hung:
+                print("Test hung: " + job.test + str(job.run))
+                phase.fout_hang.write(job.test + str(job.run) + "\n")
+                phase.fout_hang.flush()
+            elif returncode is None:
+                print("Test timed out: " + job.test + str(job.run))
+                phase.fout_timeout.write(job.test + str(job.run) + "\n")
+                phase.fout_timeout.flush()
+            self.commit(job, returncode)
+            return
+
+        if returncode == 0:
+            print("Record succeeded: " + job.test)
+            if os.path.isfile(job.record_file + part_suffix):
+                os.replace(job.record_file + part_suffix, job.record_file)
+            # Remove record fail file if a previous run of the experiment failed.
+            remove_file(job.record_fail_file)
+            self.commit(job, returncode)
+            return
+
+        if hung:
+            print("Test hung: " + job.test + " ", end="")
+        elif returncode is None:
+            print("Test timed out: " + job.test + " ", end="")
+        print("Record failed: " + job.test)
+        self.telemetry.record_failed(job.test, job.attempt)
+        # Remove record file. It is garbage.
+        remove_file(job.record_file + part_suffix)
+
+        job.attempt += 1
+        if job.attempt < phase.runs:
+            # Ahead of everything else, there may be replays waiting on this recording.
+            self.ready.appendleft(job)
+            self.telemetry.set_queue_depth(self.telemetry.queue_depth + 1)
+        else:
+            print("Unable to record after {} tries {}".format(phase.runs, job.test))
+            remove_file(job.record_file)
+            write_atomically(job.record_fail_file, b"failed")
+            self.commit(job, returncode)
+
+    def commit(self, job, returncode):
+        """Every file of the job is in place, journal it as finished."""
+        job.phase.journal("finish", job, returncode=returncode)
+        self.complete(job)
+
+    def complete(self, job):
+        if self.done is not None:
+            self.done(job)
+        self.release(job.key)
+        self.remaining[job.phase.name] -= 1
+        if self.remaining[job.phase.name] == 0:
+            self.release(("phase", job.phase.name))
+
+    def release(self, key):
+        for dependent in self.dependents.pop(key, []):
+            self.waiting[dependent] -= 1
+            if self.waiting[dependent] == 0:
+                self.blocked -= 1
+                self.ready.append(dependent)
+
+
+def write_rusage(fout_rusage, test_name, test_num, mode, returncode, wall, rusage):
+    """One json line per run in `rusage_file`. Times in seconds, max_rss in KiB."""
+    entry = {"test": test_name, "run": test_num, "mode": mode,
+             "returncode": returncode, "wall": wall}
+    if rusage is not None:
+        entry["user"] = rusage.ru_utime
+        entry["sys"] = rusage.ru_stime
+        entry["max_rss"] = rusage.ru_maxrss
+        entry["voluntary_ctx_switches"] = rusage.ru_nvcsw
+        entry["involuntary_ctx_switches"] = rusage.ru_nivcsw
+    fout_rusage.write(json.dumps(entry) + "\n")
+    fout_rusage.flush()
+    return entry
+
+
+def remove_file(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def load_spec(spec_file):
+    """The spec with defaults filled in, and its list of Phase."""
+    spec = dict(defaults)
+    spec.update(json.load(open(spec_file)))
+    timeouts = dict(defaults["timeout"])
+    if isinstance(spec["timeout"], dict):
+        timeouts.update(spec["timeout"])
+    else:
+        timeouts = {mode: spec["timeout"] for mode in modes}
+
+    if "output_dir" not in spec or "phases" not in spec:
+        raise ValueError("A spec needs both an output_dir and phases.")
+
+    phases = []
+    names = set()
+    for p in spec["phases"]:
+        name = p["name"]
+        mode = p["mode"]
+        if name in names:
+            raise ValueError("Duplicate phase name: " + name)
+        if mode not in modes:
+            raise ValueError("Unknown mode {} for phase {}. Expected one of {}".format(
+                mode, name, modes))
+
+        test_runs = None
+        if "plan" in p:
+            planned = plan_runs.read_plan(p["plan"])
+            tests = [test for (test, _, _, _) in planned]
+            test_runs = {test: runs for (test, runs, _, _) in planned}
+        else:
+            tests = p["tests"]
+            if isinstance(tests, str):
+                tests = read_tests(tests)
+
+        after = list(p.get("after", []))
+        record_dir = None
+        record = None
+        pipeline = False
+        if mode == "replay":
+            record = p.get("record")
+            record_phases = [q for q in spec["phases"] if q["name"] == record]
+            if len(record_phases) != 1 or record_phases[0]["mode"] != "record":
+                raise ValueError("Replay phase {} needs \"record\" naming a record phase."
+                                 .format(name))
+            record_dir = spec["output_dir"] + "/" + record
+            pipeline = p.get("pipeline", True)
+            if not pipeline:
+                after.append(record)
+
+        for a in after:
+            if a not in [q["name"] for q in spec["phases"]]:
+                raise ValueError("Phase {} waits for unknown phase {}".format(name, a))
+
+        phases.append(Phase(name, mode, tests, p.get("runs", spec["runs"]),
+                            p.get("timeout", timeouts[mode]),
+                            spec["output_dir"] + "/" + name, p.get("env", {}),
+                            record_dir, after, record, pipeline,
+                            p.get("pack", spec["pack"]),
+                            p.get("inactivity_timeout", spec["inactivity_timeout"]),
+                            p.get("raw_log", spec["raw_log"]), test_runs,
+                            p.get("cpu_affinity", spec["cpu_affinity"]),
+                            p.get("nice", spec["nice"]), p.get("ionice", spec["ionice"])))
+        names.add(name)
+
+    return (spec, phases)
+
+
+def drop_missing_tests(spec, phases):
+    """Remove tests which are in none of the spec's "manifests" from every phase."""
+    if spec["manifests"] == []:
+        return
+    known = wpt_manifest.load_known_tests(spec["manifests"])
+    for phase in phases:
+        phase.tests = wpt_manifest.preflight(phase.tests, known, phase.output_dir)
+
+
+def check_cpu_affinity(cpu_affinity, concurrency):
+    """Raise ValueError if a "cpu_affinity" setting can't pin `concurrency` slots."""
+    if isinstance(cpu_affinity, list) and len(cpu_affinity) < concurrency:
+        raise ValueError("cpu_affinity lists {} CPU sets for {} slots".format(
+            len(cpu_affinity), concurrency))
+
+
+def check_priorities(nice, ionice):
+    """Raise ValueError if jobs can't be started at niceness `nice` and ionice `ionice`."""
+    if ionice is not None:
+        if len(ionice) != 2 or ionice[0] not in range(4) or ionice[1] not in range(8):
+            raise ValueError("ionice {} isn't a [class 0-3, level 0-7] pair".format(ionice))
+        if shutil.which("ionice") is None:
+            raise ValueError("ionice is set but there is no ionice command")
+        if ionice[0] == 1 and os.geteuid() != 0:
+            raise ValueError("ionice class 1 (realtime) needs root")
+    if nice is not None and os.geteuid() != 0:
+        # Without privileges, niceness only goes down to our own or RLIMIT_NICE's floor.
+        floor = min(os.getpriority(os.PRIO_PROCESS, 0),
+                    20 - resource.getrlimit(resource.RLIMIT_NICE)[0])
+        if nice < floor:
+            raise ValueError("nice {} is below {}, the lowest we may set".format(nice, floor))
+
+
+def slot_cpu_sets(cpu_affinity, concurrency):
+    """CPUs of every slot for a "cpu_affinity" setting, None not to pin jobs."""
+    if cpu_affinity is False or cpu_affinity is None:
+        return None
+    if cpu_affinity is True:
+        return job_control.cpu_sets(concurrency)
+    check_cpu_affinity(cpu_affinity, concurrency)
+    return [set(cpus) for cpus in cpu_affinity]
+
+
+def open_telemetry(spec):
+    def in_output_dir(name):
+        return None if name is None else spec["output_dir"] + "/" + name
+
+    return Telemetry(in_output_dir(spec["telemetry_events_file"]),
+                     in_output_dir(spec["telemetry_textfile"]),
+                     spec["telemetry_interval"], spec["concurrency"])
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(usage)
+        sys.exit(1)
+
+    try:
+        (spec, phases) = load_spec(sys.argv[1])
+        for phase in phases:
+            check_cpu_affinity(phase.cpu_affinity, spec["concurrency"])
+            check_priorities(phase.nice, phase.ionice)
+    except (ValueError, KeyError) as e:
+        print("Invalid spec {}: {}".format(sys.argv[1], e))
+        sys.exit(1)
+
+    output_dir = spec["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    job_control.start(output_dir)
+
+    # Snapshot the environment once. Nothing a job does can leak into another one.
+    base_env = dict(os.environ)
+    base_env.update(spec["env"])
+    drop_missing_tests(spec, phases)
+    jobs = compile_jobs(phases, spec["mach_command"], base_env)
+    if spec["history"] != []:
+        history = load_history(spec)
+        jobs = order_jobs(jobs, history)
+        if adaptive_settings(spec) is not None:
+            set_timeouts(jobs, history, adaptive_settings(spec))
+    print("Compiled {} jobs in {} phases.".format(len(jobs), len(phases)))
+
+    telemetry = open_telemetry(spec)
+    Engine(phases, jobs, spec["concurrency"], telemetry, output_dir).run()
+    telemetry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+'''
+Fingerprints of run outputs, to tell whether replays reproduce the recorded execution
+without diffing outputs. Every output is normalized line by line, so that timestamps,
+pids, addresses and timings don't make identical executions look different, and hashed.
+
+Every phase of experiment.py writes a json line per run to its `fingerprint_file`:
+
+    {"test": ..., "run": ..., "mode": ..., "fingerprint": sha256 of the normalized output}
+
+`report` compares the replays of each test against its recording:
+
+python3 fingerprint.py report record_dir/ replay_dir/
+
+`normalize` prints an output file as it gets hashed, to check what is stripped.
+'''
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+from wptreport import fingerprint_file
+
+usage = """\
+Usage: python3 fingerprint.py report record_dir/ replay_dir/
+                              normalize output_file\
+"""
+
+# (pattern, replacement), applied in order to every line.
+normalizations = [
+    # mach's elapsed time prefix, " 0:01.23 ".
+    (re.compile(rb"^\s*\d+:\d\d\.\d\d "), b""),
+    # Dates and times of day.
+    (re.compile(rb"\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?"),
+     b"<time>"),
+    (re.compile(rb"\b\d\d:\d\d:\d\d(?:[.,]\d+)?\b"), b"<time>"),
+    # Process and thread ids.
+    (re.compile(rb"\b(pid|PID|tid|TID|[Pp]rocess|[Tt]hread)([ :=]+)\d+"), rb"\1\2<id>"),
+    # Pointers, symbol hashes and other hex addresses.
+    (re.compile(rb"\b0x[0-9a-fA-F]+\b"), b"<addr>"),
+    (re.compile(rb"::h[0-9a-f]{16}\b"), b"::<hash>"),
+    # Timings, "took 123ms", "in 1.5 s".
+    (re.compile(rb"\b\d+(?:\.\d+)?\s?(?:ns|us|ms|s)\b"), b"<duration>"),
+    # Ports of the wptserve instance and temporary paths.
+    (re.compile(rb"(localhost|127\.0\.0\.1|web-platform\.test):\d+"), rb"\1:<port>"),
+    (re.compile(rb"/tmp/[^\s'\"]+"), b"<tmp>"),
+]
+
+
+def normalize(line):
+    for (pattern, replacement) in normalizations:
+        line = pattern.sub(replacement, line)
+    return line
+
+
+class Fingerprint:
+    """Incremental fingerprint of an output, fed in chunks as it is captured."""
+
+    def __init__(self):
+        self.sha = hashlib.sha256()
+        # Start of a line whose end hasn't been seen yet.
+        self.partial = b""
+
+    def update(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.sha.update(normalize(line) + b"\n")
+
+    def hexdigest(self):
+        sha = self.sha.copy()
+        if self.partial != b"":
+            sha.update(normalize(self.partial) + b"\n")
+        return sha.hexdigest()
+
+
+def fingerprint(contents):
+    f = Fingerprint()
+    f.update(contents)
+    return f.hexdigest()
+
+
+def write_fingerprint(fout, test_name, test_num, mode, fp):
+    fout.write(json.dumps({"test": test_name, "run": test_num, "mode": mode,
+                           "fingerprint": fp}) + "\n")
+    fout.flush()
+
+
+def read_fingerprints(output_dir):
+    """(test, run) -> fingerprint. A run written more than once counts as its last one."""
+    fingerprints = {}
+    path = output_dir + "/" + fingerprint_file
+    if not os.path.isfile(path):
+        print("File " + path + " does not exist. Was it written before fingerprints?")
+        sys.exit(1)
+    for line in open(path):
+        entry = json.loads(line)
+        fingerprints[(entry["test"], entry["run"])] = entry["fingerprint"]
+    return fingerprints
+
+
+def report(record_dir, replay_dir):
+    recorded = {test: fp for ((test, _), fp) in read_fingerprints(record_dir).items()}
+    replays = {}
+    for ((test, _), fp) in read_fingerprints(replay_dir).items():
+        replays.setdefault(test, []).append(fp)
+
+    print("name, record, replays, distinct, matching_record")
+    for test in sorted(replays):
+        fps = replays[test]
+        record_fp = recorded.get(test)
+        matching = sum(1 for fp in fps if fp == record_fp)
+        print("{}, {}, {}, {}, {}".format(test, record_fp[:12] if record_fp else None,
+                                          len(fps), len(set(fps)), matching))
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "report":
+        report(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "normalize":
+        for line in open(sys.argv[2], "rb"):
+            sys.stdout.buffer.write(normalize(line.rstrip(b"\n")) + b"\n")
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+'''
+Builds intermittent_failures.txt from a local dump of Servo's GitHub issues, instead of
+scraping the live API like github_scrape_intermittent_failures.py did. Get the dump with
+e.g.
+
+gh api --paginate "repos/servo/servo/issues?labels=I-intermittent&state=all&per_page=100" > issues.json
+
+Dumps may be a json list of issues, several lists back to back (what --paginate writes)
+or one issue per line. Every issue labelled I-intermittent whose title names a test path
+contributes that path.
+
+What was parsed out of each issue is cached by issue number and `updated_at`, so
+refreshing the list from a new dump only looks at issues which changed since.
+'''
+
+import json
+import os
+import sys
+
+usage = """\
+Usage: python3 intermittent_issues.py cache.json output_file issues.json...\
+"""
+
+label = "I-intermittent"
+
+header = """\
+# This file was generated by `intermittent_issues.py` from a dump of Servo's github issues.
+# It lists all tests in Servo that were known to have intermittent failures.
+"""
+
+# Characters quoting or punctuating a path in an issue title.
+quotes = "`'\",;:()[]"
+
+# Titles sometimes give the path from the root of the Servo repository.
+wpt_dirs = ["tests/wpt/web-platform-tests/", "tests/wpt/mozilla/tests/"]
+
+
+def read_issues(dump_file):
+    """Every issue in `dump_file`, however the json values in it are laid out."""
+    contents = open(dump_file).read()
+    decoder = json.JSONDecoder()
+    i = 0
+    while True:
+        while i < len(contents) and contents[i].isspace():
+            i += 1
+        if i == len(contents):
+            return
+        (value, i) = decoder.raw_decode(contents, i)
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def is_intermittent(issue):
+    # Pull requests show up in the issues API too.
+    if "pull_request" in issue:
+        return False
+    for l in issue.get("labels", []):
+        if (l["name"] if isinstance(l, dict) else l) == label:
+            return True
+    return False
+
+
+def title_to_path(title):
+    """The test path named in an issue title, or None."""
+    path = None
+    # The last one wins, titles look like "Intermittent TIMEOUT in /foo/bar.html".
+    for word in title.split():
+        word = word.strip(quotes)
+        for wpt_dir in wpt_dirs:
+            if wpt_dir in word:
+                prefix = "/_mozilla/" if "mozilla" in wpt_dir else "/"
+                word = prefix + word[word.index(wpt_dir) + len(wpt_dir):]
+        if word.startswith("/") and "." in word.split("/")[-1]:
+            path = word
+    return path
+
+
+def build(cache, issues):
+    """
+    Update `cache` (issue number -> {"updated_at", "path"}) from `issues`. Returns how
+    many issues had to be parsed.
+    """
+    parsed = 0
+    for issue in issues:
+        number = str(issue["number"])
+        cached = cache.get(number)
+        if cached is not None and cached["updated_at"] == issue["updated_at"]:
+            continue
+
+        path = title_to_path(issue["title"]) if is_intermittent(issue) else None
+        cache[number] = {"updated_at": issue["updated_at"], "path": path}
+        parsed += 1
+    return parsed
+
+
+def main():
+    if len(sys.argv) < 4:
+        print(usage)
+        sys.exit(1)
+
+    cache_file = sys.argv[1]
+    output_file = sys.argv[2]
+
+    cache = {}
+    if os.path.isfile(cache_file):
+        cache = json.load(open(cache_file))
+
+    parsed = 0
+    for dump_file in sys.argv[3:]:
+        parsed += build(cache, read_issues(dump_file))
+
+    with open(cache_file + ".part", "w") as fout:
+        json.dump(cache, fout)
+    os.replace(cache_file + ".part", cache_file)
+
+    paths = sorted({entry["path"] for entry in cache.values() if entry["path"] is not None})
+    with open(output_file, "w") as fout:
+        fout.write(header)
+        for path in paths:
+            fout.write(path + "\n")
+
+    print("Parsed {} new or updated issues of {}. {} intermittent tests written to {}"
+          .format(parsed, len(cache), len(paths), output_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+'''
+Process group handling for runner jobs.
+
+Jobs are started through `shell=True`, so the Popen we hold is only the shell. mach, Servo
+and wptserve underneath it used to outlive a timed out job and pile up. Every job now runs
+in its own session, so its whole process tree can be signalled as one process group, and
+is tagged with `marker_env` so that jobs leaked by a runner that crashed can be found
+and killed by the next one.
+'''
+
+import atexit
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Seconds between SIGTERM and SIGKILL when killing a job's process group.
+kill_grace_period = 5
+
+# Set to the (absolute) output dir in the environment of every job.
+marker_env = "RR_RUNNER_OUTPUT_DIR"
+
+# Process group ids of jobs which are still running.
+live_groups = set()
+
+
+def start(output_dir):
+    """
+    Kill anything a previous runner on `output_dir` leaked, and make sure we clean up
+    after ourselves however this runner exits.
+    """
+    output_dir = os.path.abspath(output_dir)
+    killed = sweep(output_dir)
+    if killed != 0:
+        print("Killed {} processes leaked by a previous run.".format(killed))
+
+    atexit.register(shutdown, output_dir)
+    # Default SIGTERM handling would skip atexit handlers.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+
+def spawn(command, stdout, env, output_dir, cpus=None, nice=None, ionice=None):
+    """
+    Popen `command` as the leader of a new session and process group. Optionally pinned to
+    the set of `cpus`, at `nice` and with ionice (class, level) `ionice`.
+    """
+    env = dict(env)
+    env[marker_env] = os.path.abspath(output_dir)
+    if ionice is not None:
+        # No ioprio_set in Python, util-linux' ionice it is.
+        command = "ionice -c {} -n {} {}".format(ionice[0], ionice[1], command)
+
+    if cpus is None:
+        rp = subprocess.Popen(command, shell=True, stdout=stdout, env=env,
+                              start_new_session=True)
+    else:
+        # The affinity of the calling thread is inherited on fork, so the job is pinned
+        # from its very first instruction.
+        own_cpus = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        try:
+            rp = subprocess.Popen(command, shell=True, stdout=stdout, env=env,
+                                  start_new_session=True)
+        finally:
+            os.sched_setaffinity(0, own_cpus)
+    live_groups.add(rp.pid)
+
+    if nice is not None:
+        # Whatever the shell forked already is in its group, everything else inherits it.
+        try:
+            os.setpriority(os.PRIO_PGRP, rp.pid, nice)
+        except ProcessLookupError:
+            pass
+    return rp
+
+
+def cpu_sets(n):
+    """
+    Split the CPUs we may run on into `n` disjoint sets of about equal size, one per slot.
+    With fewer CPUs than slots, slots have to share.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < n:
+        print("Only {} CPUs for {} slots, slots will share CPUs.".format(len(cpus), n))
+        return [{cpus[i % len(cpus)]} for i in range(n)]
+    size = len(cpus) // n
+    extra = len(cpus) % n
+    sets = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(set(cpus[start:end]))
+        start = end
+    return sets
+
+
+def finished(rp):
+    """The job's shell exited on its own. Kill anything it left behind."""
+    signal_group(rp.pid, signal.SIGKILL)
+    live_groups.discard(rp.pid)
+
+
+class Kill:
+    """
+    A job being killed: its process group gets SIGTERM right away and SIGKILL once `grace`
+    seconds passed, unless it is gone by then. Doesn't block, `poll` it until it returns
+    the shell's rusage.
+    """
+
+    def __init__(self, rp, grace=None):
+        self.rp = rp
+        self.deadline = time.time() + (kill_grace_period if grace is None else grace)
+        self.rusage = None
+        # When the shell was reaped.
+        self.reaped = None
+        signal_group(rp.pid, signal.SIGTERM)
+
+    def poll(self):
+        """The shell's rusage once the whole group is dead, None while it isn't."""
+        if self.rusage is None:
+            self.rusage = try_reap(self.rp)
+            if self.rusage is not None:
+                self.reaped = time.time()
+        # The shell is gone and so is everything else in its group.
+        gone = self.rusage is not None and not signal_group(self.rp.pid, 0)
+        if not gone and time.time() < self.deadline:
+            return None
+
+        signal_group(self.rp.pid, signal.SIGKILL)
+        if self.rusage is None:
+            (_, status, self.rusage) = os.wait4(self.rp.pid, 0)
+            self.rp.returncode = os.waitstatus_to_exitcode(status)
+            self.reaped = time.time()
+        live_groups.discard(self.rp.pid)
+        return self.rusage
+
+
+def try_reap(rp):
+    """Reap `rp` if it exited, returning its rusage. None if it is still running."""
+    (pid, status, rusage) = os.wait4(rp.pid, os.WNOHANG)
+    if pid != rp.pid:
+        return None
+    # Let Popen know it has been reaped so it never waits on it again.
+    rp.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def signal_group(pgid, sig):
+    """Send `sig` to a process group. Returns False if the group no longer exists."""
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+
+def sweep(output_dir):
+    """
+    Kill every process tagged with `output_dir`, whether it still is in its job's process
+    group or not. Returns the number of processes found.
+    """
+    marker = (marker_env + "=" + output_dir).encode()
+    own_group = os.getpgrp()
+    groups = set()
+    found = 0
+
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            environ = open("/proc/" + pid + "/environ", "rb").read().split(b"\0")
+            if marker not in environ:
+                continue
+            found += 1
+            pgid = os.getpgid(int(pid))
+        except (OSError, ProcessLookupError):
+            # Gone already, or not ours to look at.
+            continue
+        if pgid != own_group:
+            groups.add(pgid)
+
+    for pgid in groups:
+        signal_group(pgid, signal.SIGTERM)
+    deadline = time.time() + kill_grace_period
+    while time.time() < deadline and any(signal_group(g, 0) for g in groups):
+        reap_zombies()
+        time.sleep(0.05)
+    for pgid in groups:
+        signal_group(pgid, signal.SIGKILL)
+
+    return found
+
+
+def reap_zombies():
+    """Reap any of our children that already exited."""
+    while True:
+        try:
+            (pid, _) = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def shutdown(output_dir):
+    for pgid in live_groups:
+        signal_group(pgid, signal.SIGTERM)
+    sweep(output_dir)
+    for pgid in live_groups:
+        signal_group(pgid, signal.SIGKILL)
+    reap_zombies()
+    live_groups.clear()
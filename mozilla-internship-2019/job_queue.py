@@ -0,0 +1,545 @@
+'''
+Spread an experiment over several machines through a durable job queue.
+
+The coordinator keeps every (phase, test, run) job of an experiment spec in a SQLite
+database, with its phase's settings. Workers lease a job whenever one of their slots is
+free, run it with the same Engine as experiment.py in their own work dir, and upload its
+output, raw log, rusage entry and, for record jobs, the .record file as soon as it is
+done. A worker which can't apply a job's settings, e.g. its cpu_affinity, exits rather
+than run it differently. Replay jobs are only handed out once their test has been
+recorded, and come with the record file. Leases a worker doesn't renew in time, because it
+died or lost the network, expire and their jobs are handed out again.
+
+Workers on the same host can open the database directly. Workers on other hosts talk to
+`serve`, a small HTTP front for the same database:
+
+    coordinator$ python3 job_queue.py enqueue queue.db spec.json
+    coordinator$ python3 job_queue.py serve queue.db 8765
+    runner-1$    python3 job_queue.py work http://coordinator:8765 work_dir/ 4
+    runner-2$    python3 job_queue.py work http://coordinator:8765 work_dir/ 4
+    coordinator$ python3 job_queue.py collect queue.db output_dir/
+
+`collect` lays out the uploaded results exactly like experiment.py would, one dir per
+phase with its outputs packed, so `analyse_output` works on them.
+'''
+
+import base64
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import classify
+import durations
+import experiment
+import fingerprint
+import job_control
+import packs
+import rawlog
+from telemetry import Telemetry
+
+usage = """\
+Usage: python3 job_queue.py enqueue queue.db spec.json
+                            serve   queue.db [port]
+                            work    (queue.db|http://host:port) work_dir/ [slots]
+                            collect queue.db output_dir/
+                            status  (queue.db|http://host:port)\
+"""
+
+# Seconds a worker holds its jobs without renewing the lease.
+lease_seconds = 300
+# Seconds a worker waits before asking again when there was nothing to lease.
+idle_seconds = 5
+default_port = 8765
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    phase TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    test TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    -- Attempts for record jobs.
+    runs INTEGER NOT NULL,
+    timeout REAL NOT NULL,
+    -- Seconds without output before the job is killed as hung, NULL for never.
+    inactivity_timeout REAL,
+    command TEXT NOT NULL,
+    -- json object, on top of the worker's own environment.
+    env TEXT NOT NULL,
+    -- json list of phases which must be done first.
+    after TEXT NOT NULL,
+    record_phase TEXT,
+    -- The phase's "pack", "raw_log", "cpu_affinity" (json), "nice" and "ionice" (json).
+    pack INTEGER NOT NULL,
+    raw_log INTEGER NOT NULL,
+    cpu_affinity TEXT NOT NULL,
+    nice INTEGER,
+    ionice TEXT NOT NULL,
+    -- The record job of this test, for replay jobs.
+    depends_on INTEGER REFERENCES jobs(id),
+    -- queued, leased or done.
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    -- Whether the job's last run was killed for going silent.
+    hung INTEGER NOT NULL DEFAULT 0,
+    -- json `rusage_file` entry of the job's last run.
+    result TEXT,
+    output BLOB,
+    record BLOB,
+    -- Raw structured log, for raw_log jobs.
+    mozlog BLOB,
+    UNIQUE (phase, test, run)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+-- In lease order, so leasing stops at the first few ready jobs.
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (state, mode != 'record', id);
+-- Jobs of every phase which aren't done, for phases waiting on it.
+CREATE TABLE IF NOT EXISTS phases (
+    name TEXT PRIMARY KEY,
+    pending INTEGER NOT NULL
+);
+"""
+
+
+class Queue:
+    """The job queue, straight on the SQLite database."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        with closing(self.connect()) as db:
+            db.executescript(schema)
+
+    def connect(self):
+        # Autocommit, we BEGIN IMMEDIATE ourselves so concurrent leases never overlap.
+        return sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+
+    def enqueue(self, spec, phases):
+        """Jobs are leased in the order they are enqueued, longest tests first."""
+        history = experiment.load_history(spec)
+        timeouts = None
+        if experiment.adaptive_settings(spec) is not None:
+            timeouts = durations.AdaptiveTimeouts(history, experiment.adaptive_settings(spec))
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            for phase in phases:
+                env = dict(spec["env"])
+                env.update(phase.env)
+                for test in durations.longest_first(phase.tests, history):
+                    runs = [0] if phase.mode == "record" else range(0, phase.runs_of(test))
+                    timeout = phase.timeout
+                    if timeouts is not None:
+                        timeout = timeouts.timeout(test, phase.mode, phase.timeout)
+                    for run in runs:
+                        db.execute(
+                            "INSERT OR IGNORE INTO jobs (phase, mode, test, run, runs, timeout,"
+                            " inactivity_timeout, command, env, after, record_phase, pack,"
+                            " raw_log, cpu_affinity, nice, ionice)"
+                            " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                            (phase.name, phase.mode, test, run, phase.runs, timeout,
+                             phase.inactivity_timeout, spec["mach_command"] + test,
+                             json.dumps(env), json.dumps(phase.after), phase.record_phase,
+                             phase.pack_outputs, phase.raw_log,
+                             json.dumps(phase.cpu_affinity), phase.nice,
+                             json.dumps(phase.ionice)))
+            db.execute(
+                "UPDATE jobs SET depends_on = (SELECT r.id FROM jobs r WHERE"
+                " r.phase = jobs.record_phase AND r.test = jobs.test AND r.run = 0)"
+                " WHERE mode = 'replay'")
+            db.execute("INSERT OR REPLACE INTO phases (name, pending)"
+                       " SELECT phase, sum(state != 'done') FROM jobs GROUP BY phase")
+            db.execute("COMMIT")
+
+    def lease(self, worker, n):
+        """Up to `n` jobs that are ready to run, as dicts. Record jobs first."""
+        now = time.time()
+        with closing(self.connect()) as db:
+            db.row_factory = sqlite3.Row
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE jobs SET state = 'queued', worker = NULL"
+                       " WHERE state = 'leased' AND lease_expires < ?", (now,))
+
+            # Whatever order phases were enqueued in, none of a job's `after` phases may
+            # have a job left which isn't done.
+            candidates = db.execute(
+                "SELECT j.*, d.record AS dep_record FROM jobs j"
+                " LEFT JOIN jobs d ON d.id = j.depends_on"
+                " WHERE j.state = 'queued' AND (j.depends_on IS NULL OR d.state = 'done')"
+                " AND NOT EXISTS (SELECT 1 FROM json_each(j.after) a"
+                " JOIN phases p ON p.name = a.value WHERE p.pending != 0)"
+                " ORDER BY j.state, j.mode != 'record', j.id LIMIT ?", (n,))
+
+            jobs = []
+            for row in candidates:
+                job = {k: row[k] for k in row.keys() if k not in ["output", "record", "mozlog"]}
+                job["dep_record"] = encode(row["dep_record"])
+                jobs.append(job)
+
+            for job in jobs:
+                db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?,"
+                           " leases = leases + 1 WHERE id = ?",
+                           (worker, now + lease_seconds, job["id"]))
+            db.execute("COMMIT")
+        return jobs
+
+    def renew(self, worker, ids):
+        with closing(self.connect()) as db:
+            for i in ids:
+                db.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ?"
+                           " AND state = 'leased'", (time.time() + lease_seconds, i, worker))
+
+    def complete(self, worker, job_id, result, output, record, mozlog, hung):
+        """Store a job's results. The first worker to finish a job wins."""
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            done = db.execute(
+                "UPDATE jobs SET state = 'done', worker = ?, result = ?, output = ?,"
+                " record = ?, mozlog = ?, hung = ? WHERE id = ? AND state != 'done'",
+                (worker, json.dumps(result), decode(output), decode(record), decode(mozlog),
+                 hung, job_id)).rowcount
+            if done == 1:
+                db.execute("UPDATE phases SET pending = pending - 1"
+                           " WHERE name = (SELECT phase FROM jobs WHERE id = ?)", (job_id,))
+            db.execute("COMMIT")
+
+    def status(self):
+        with closing(self.connect()) as db:
+            counts = dict(db.execute("SELECT state, count(*) FROM jobs GROUP BY state"))
+        return {state: counts.get(state, 0) for state in ["queued", "leased", "done"]}
+
+    def collect(self, output_dir):
+        """
+        Write every finished job out like experiment.py would have, outputs packed unless
+        their phase's "pack" is off.
+        """
+        fouts = {}
+        with closing(self.connect()) as db:
+            rows = db.execute("SELECT phase, mode, test, run, pack, result, output, record,"
+                              " mozlog, hung FROM jobs WHERE state = 'done' ORDER BY id")
+            for (phase, mode, test, run, pack_outputs, result, output, record, mozlog,
+                 hung) in rows:
+                phase_dir = output_dir + "/" + phase
+                if phase not in fouts:
+                    os.makedirs(phase_dir, exist_ok=True)
+                    fouts[phase] = (open(phase_dir + "/" + experiment.timeout_file, "w"),
+                                    open(phase_dir + "/" + experiment.hang_file, "w"),
+                                    open(phase_dir + "/" + experiment.rusage_file, "w"),
+                                    open(phase_dir + "/" + experiment.fingerprint_file, "w"),
+                                    open(phase_dir + "/" + experiment.status_file, "w"),
+                                    packs.Pack(phase_dir) if pack_outputs else None)
+                (fout_timeout, fout_hang, fout_rusage, fout_fingerprints, fout_status,
+                 pack) = fouts[phase]
+
+                prefix = phase_dir + "/" + test.replace('/', '_')
+                result = json.loads(result)
+                if result is not None:
+                    fout_rusage.write(json.dumps(result) + "\n")
+
+                if mode == "record":
+                    write_file = prefix
+                    if record is not None:
+                        open(prefix + ".record", "wb").write(record)
+                    else:
+                        open(prefix + ".record_fail", "w").write("failed")
+                else:
+                    write_file = prefix + str(run)
+                    if hung:
+                        fout_hang.write(test + str(run) + "\n")
+                    elif result is not None and result["returncode"] is None:
+                        fout_timeout.write(test + str(run) + "\n")
+
+                if mozlog is not None:
+                    keep(pack, write_file + rawlog.suffix, mozlog)
+                if output is not None:
+                    keep(pack, write_file, output)
+                    fingerprint.write_fingerprint(fout_fingerprints, test, run, mode,
+                                                  fingerprint.fingerprint(output))
+                    if mozlog is not None:
+                        (status, crashed) = rawlog.classify(test, mozlog)
+                    else:
+                        (status, crashed) = classify.classify(test, output)
+                    classify.write_status(fout_status, test, run, mode, status, crashed)
+
+        for (fout_timeout, fout_hang, fout_rusage, fout_fingerprints, fout_status,
+             pack) in fouts.values():
+            fout_timeout.close()
+            fout_hang.close()
+            fout_rusage.close()
+            fout_fingerprints.close()
+            fout_status.close()
+            if pack is not None:
+                pack.close()
+
+
+def keep(pack, path, contents):
+    """Put a collected output in its phase's pack, or in place if there is none."""
+    if pack is not None:
+        pack.add(os.path.basename(path), contents)
+    else:
+        open(path, "wb").write(contents)
+
+
+class HttpQueue:
+    """Same interface as Queue, through `serve`."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def call(self, method, **args):
+        request = urllib.request.Request(self.url + "/" + method, json.dumps(args).encode(),
+                                         {"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return json.loads(response.read())
+
+    def lease(self, worker, n):
+        return self.call("lease", worker=worker, n=n)
+
+    def renew(self, worker, ids):
+        return self.call("renew", worker=worker, ids=ids)
+
+    def complete(self, worker, job_id, result, output, record, mozlog, hung):
+        return self.call("complete", worker=worker, job_id=job_id, result=result,
+                         output=output, record=record, mozlog=mozlog, hung=hung)
+
+    def status(self):
+        return self.call("status")
+
+
+def serve(queue, port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.strip("/")
+            if method not in ["lease", "renew", "complete", "status"]:
+                self.send_error(404)
+                return
+            args = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            body = json.dumps(getattr(queue, method)(**args)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    print("Serving {} on port {}".format(queue.db_file, port))
+    server.serve_forever()
+
+
+def work(queue, work_dir, slots):
+    """Lease, run and upload jobs until there is nothing left to do."""
+    job_control.start(work_dir)
+    telemetry = Telemetry(work_dir + "/" + experiment.defaults["telemetry_events_file"],
+                          work_dir + "/" + experiment.defaults["telemetry_textfile"],
+                          experiment.defaults["telemetry_interval"], slots)
+    worker = Worker(queue, work_dir, slots)
+
+    stop_renewing = threading.Event()
+    renewer = threading.Thread(target=worker.renew_leases, args=(stop_renewing,), daemon=True)
+    renewer.start()
+    try:
+        worker.engine = experiment.Engine([], [], slots, telemetry, work_dir, worker.lease,
+                                          worker.upload)
+        worker.engine.run()
+    finally:
+        stop_renewing.set()
+        renewer.join()
+
+    telemetry.close()
+    print("No jobs left.")
+
+
+class Worker:
+    """
+    Feeds an Engine with leased jobs, one whenever a slot frees up, and uploads every job
+    as soon as it is done.
+    """
+
+    def __init__(self, queue, work_dir, slots):
+        self.queue = queue
+        self.name = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.work_dir = work_dir
+        self.slots = slots
+        self.base_env = dict(os.environ)
+        # Phase name -> Phase, as the first job of the phase leased here said.
+        self.phases = {}
+        # Job -> its id, of the jobs leased and not uploaded yet. Shared with the renewer.
+        self.leased = {}
+        self.lock = threading.Lock()
+        # No asking for jobs before then, there were none last time.
+        self.idle_until = 0
+        # The Engine running the jobs, for their results.
+        self.engine = None
+
+    def lease(self, n):
+        """Engine's `more`: up to `n` jobs, [] if there are none right now, None if done."""
+        if time.time() < self.idle_until:
+            return []
+        leased = self.queue.lease(self.name, n)
+        if len(leased) == 0:
+            status = self.queue.status()
+            if status["queued"] == 0 and status["leased"] == 0:
+                return None
+            # Waiting on recordings or phases running elsewhere.
+            self.idle_until = time.time() + idle_seconds
+            return []
+
+        print("Leased {} jobs.".format(len(leased)))
+        jobs = []
+        for leased_job in leased:
+            job = self.job(leased_job)
+            with self.lock:
+                self.leased[job] = leased_job["id"]
+            jobs.append(job)
+        return jobs
+
+    def phase(self, leased_job):
+        name = leased_job["phase"]
+        if name in self.phases:
+            return self.phases[name]
+
+        record_dir = None
+        if leased_job["mode"] == "replay":
+            record_dir = self.work_dir + "/" + leased_job["record_phase"]
+            os.makedirs(record_dir, exist_ok=True)
+        # Outputs are uploaded one by one, "pack" is for collect.
+        phase = experiment.Phase(name, leased_job["mode"], [], leased_job["runs"],
+                                 leased_job["timeout"], self.work_dir + "/" + name,
+                                 json.loads(leased_job["env"]), record_dir,
+                                 inactivity_timeout=leased_job["inactivity_timeout"],
+                                 raw_log=bool(leased_job["raw_log"]),
+                                 cpu_affinity=json.loads(leased_job["cpu_affinity"]),
+                                 nice=leased_job["nice"],
+                                 ionice=json.loads(leased_job["ionice"]))
+        check_settings(phase, self.slots)
+        os.makedirs(phase.output_dir, exist_ok=True)
+        # Every leased job runs again, whatever an earlier worker journaled here.
+        experiment.remove_file(phase.output_dir + "/" + experiment.journal_file)
+        self.phases[name] = phase
+        return phase
+
+    def job(self, leased_job):
+        phase = self.phase(leased_job)
+        phase.tests.append(leased_job["test"])
+        job = experiment.Job(phase, leased_job["test"], leased_job["run"],
+                             leased_job["command"], self.base_env)
+        job.timeout = leased_job["timeout"]
+
+        # Whatever is in the work dir is from an earlier lease of this job, start over.
+        experiment.remove_file(job.write_file)
+        if job.raw_log_file is not None:
+            experiment.remove_file(job.raw_log_file)
+        if job.mode == "record":
+            experiment.remove_file(job.record_file)
+            experiment.remove_file(job.record_fail_file)
+        if job.mode == "replay":
+            if leased_job["dep_record"] is not None:
+                open(job.record_file, "wb").write(decode(leased_job["dep_record"]))
+                experiment.remove_file(job.record_fail_file)
+            else:
+                open(job.record_fail_file, "w").write("failed")
+        return job
+
+    def upload(self, job):
+        """Engine's `done`."""
+        with self.lock:
+            job_id = self.leased.pop(job)
+        record = None
+        if job.mode == "record" and os.path.isfile(job.record_file):
+            record = read_encoded(job.record_file)
+        output = None
+        if os.path.isfile(job.write_file):
+            output = read_encoded(job.write_file)
+        mozlog = None
+        if job.raw_log_file is not None and os.path.isfile(job.raw_log_file):
+            mozlog = read_encoded(job.raw_log_file)
+        result = self.engine.results.get(job.key)
+        self.queue.complete(self.name, job_id, result, output, record, mozlog, job.hung)
+        # It may have been what other jobs, or the end of the queue, were waiting for.
+        self.idle_until = 0
+
+    def renew_leases(self, stop):
+        while not stop.wait(lease_seconds / 3):
+            with self.lock:
+                ids = list(self.leased.values())
+            self.queue.renew(self.name, ids)
+
+
+def check_settings(phase, slots):
+    """Exit if this worker can't run `phase`'s jobs the way its spec asks for."""
+    problem = None
+    try:
+        experiment.check_cpu_affinity(phase.cpu_affinity, slots)
+    except ValueError as e:
+        problem = str(e)
+    if isinstance(phase.cpu_affinity, list):
+        missing = set(c for cpus in phase.cpu_affinity for c in cpus) - os.sched_getaffinity(0)
+        if len(missing) != 0:
+            problem = "cpu_affinity names CPUs {} we can't run on".format(sorted(missing))
+    try:
+        experiment.check_priorities(phase.nice, phase.ionice)
+    except ValueError as e:
+        problem = str(e)
+
+    if problem is not None:
+        print("Can't run jobs of phase {} on this worker: {}".format(phase.name, problem))
+        sys.exit(1)
+
+
+def read_encoded(path):
+    with open(path, "rb") as fin:
+        return encode(fin.read())
+
+
+def encode(blob):
+    return None if blob is None else base64.b64encode(blob).decode()
+
+
+def decode(text):
+    return None if text is None else base64.b64decode(text)
+
+
+def open_queue(location):
+    if location.startswith("http://") or location.startswith("https://"):
+        return HttpQueue(location)
+    return Queue(location)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "enqueue" and len(sys.argv) == 4:
+        (spec, phases) = experiment.load_spec(sys.argv[3])
+        experiment.drop_missing_tests(spec, phases)
+        queue = Queue(sys.argv[2])
+        queue.enqueue(spec, phases)
+        print(queue.status())
+    elif command == "serve" and len(sys.argv) in [3, 4]:
+        port = int(sys.argv[3]) if len(sys.argv) == 4 else default_port
+        serve(Queue(sys.argv[2]), port)
+    elif command == "work" and len(sys.argv) in [4, 5]:
+        work_dir = sys.argv[3]
+        os.makedirs(work_dir, exist_ok=True)
+        slots = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+        work(open_queue(sys.argv[2]), work_dir, slots)
+    elif command == "collect" and len(sys.argv) == 4:
+        Queue(sys.argv[2]).collect(sys.argv[3])
+    elif command == "status" and len(sys.argv) == 3:
+        print(open_queue(sys.argv[2]).status())
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
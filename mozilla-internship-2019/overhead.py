@@ -0,0 +1,140 @@
+'''
+rr's timing overhead, with bootstrap confidence intervals, from the raw durations of every
+run in the rusage_file of a baseline and a replay (or record) output dir. Replaces
+scripts/old-scripts/generate_timing_graph.py, which compared two hand collected means.
+
+A test's overhead is median(replay walls) / median(baseline walls). Its confidence
+interval comes from resampling both sets of runs `iterations` times; it is significant if
+the interval doesn't contain 1. The suite-wide overhead is the median of the tests'
+overheads, its interval from resampling tests as well.
+
+Runs the rig killed have their timeout as wall time and are left out. Resampling is
+batched array math over every test with the same number of runs, so thousands of tests ×
+1000 iterations take seconds.
+
+python3 overhead.py baseline_dir/ replay_dir/ --iterations 1000 --confidence 0.95
+'''
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from wptreport import rusage_file
+
+# Most floats a batch of resamples may hold at once.
+batch_elements = 20000000
+
+
+def read_walls(output_dir):
+    """test -> wall seconds of every run which exited, last entry of every run."""
+    path = output_dir + "/" + rusage_file
+    if not os.path.isfile(path):
+        print("File " + path + " does not exist. Was it written before rusage files?")
+        sys.exit(1)
+
+    entries = {}
+    for line in open(path):
+        entry = json.loads(line)
+        entries[(entry["test"], entry["run"])] = entry
+
+    walls = {}
+    for entry in entries.values():
+        if entry["returncode"] is not None:
+            walls.setdefault(entry["test"], []).append(entry["wall"])
+    return walls
+
+
+def bootstrap_medians(walls, iterations, rng):
+    """
+    walls: list of arrays of runs, one per test.
+    Returns (tests × iterations) medians of resampled runs.
+    """
+    medians = np.empty((len(walls), iterations))
+    by_runs = {}
+    for (i, w) in enumerate(walls):
+        by_runs.setdefault(len(w), []).append(i)
+
+    for (runs, tests) in by_runs.items():
+        # With every test's runs sorted, the median of a resample is where the middle of
+        # its sorted picks point. Sorting small ints is much faster than np.median.
+        values = np.sort(np.array([walls[i] for i in tests]), axis=1)
+        dtype = np.int16 if runs <= np.iinfo(np.int16).max else np.int32
+        batch = max(1, batch_elements // (iterations * runs))
+        for start in range(0, len(tests), batch):
+            chunk = values[start:start + batch]
+            picks = np.sort(rng.integers(0, runs, size=(len(chunk), iterations, runs),
+                                         dtype=dtype), axis=2)
+            low = np.take_along_axis(chunk, picks[:, :, (runs - 1) // 2], axis=1)
+            high = np.take_along_axis(chunk, picks[:, :, runs // 2], axis=1)
+            medians[tests[start:start + batch]] = (low + high) / 2
+    return medians
+
+
+def overheads(baseline, replay, iterations, confidence, seed):
+    """
+    Per test (test, baseline runs, replay runs, baseline median, replay median, overhead,
+    low, high), and the suite's (overhead, low, high).
+    """
+    rng = np.random.default_rng(seed)
+    tests = sorted(t for t in baseline.keys() & replay.keys()
+                   if len(baseline[t]) > 1 and len(replay[t]) > 1)
+    if tests == []:
+        return ([], None)
+
+    base_walls = [np.array(baseline[t]) for t in tests]
+    replay_walls = [np.array(replay[t]) for t in tests]
+    base_medians = np.array([np.median(w) for w in base_walls])
+    replay_medians = np.array([np.median(w) for w in replay_walls])
+    ratios = replay_medians / base_medians
+
+    boot = bootstrap_medians(replay_walls, iterations, rng) / \
+        bootstrap_medians(base_walls, iterations, rng)
+    tail = (1 - confidence) / 2 * 100
+    (low, high) = np.percentile(boot, [tail, 100 - tail], axis=1)
+
+    # Resample tests too: iteration b of the suite takes iteration b of random tests.
+    picks = rng.integers(0, len(tests), size=(iterations, len(tests)))
+    suite_boot = np.median(boot[picks, np.arange(iterations)[:, None]], axis=1)
+    suite = (np.median(ratios),) + tuple(np.percentile(suite_boot, [tail, 100 - tail]))
+
+    results = [(t, len(baseline[t]), len(replay[t]), base_medians[i], replay_medians[i],
+                ratios[i], low[i], high[i]) for (i, t) in enumerate(tests)]
+    return (results, suite)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rr timing overhead per test.")
+    parser.add_argument("baseline_dir")
+    parser.add_argument("replay_dir")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    baseline = read_walls(args.baseline_dir)
+    replay = read_walls(args.replay_dir)
+    (results, suite) = overheads(baseline, replay, args.iterations, args.confidence,
+                                 args.seed)
+    skipped = len(baseline.keys() | replay.keys()) - len(results)
+    if skipped != 0:
+        print("Skipping {} tests without at least two exited runs in both dirs.".format(
+            skipped), file=sys.stderr)
+
+    print("name, baseline_runs, replay_runs, baseline_median, replay_median, overhead, "
+          "ci_low, ci_high, significant")
+    for (test, base_runs, replay_runs, base_median, replay_median, ratio, low, high) \
+            in results:
+        significant = low > 1 or high < 1
+        print("{}, {}, {}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {}".format(
+            test, base_runs, replay_runs, base_median, replay_median, ratio, low, high,
+            significant))
+    if suite is not None:
+        print("suite, {}, , , , {:.3f}, {:.3f}, {:.3f}, {}".format(
+            len(results), suite[0], suite[1], suite[2], suite[1] > 1 or suite[2] < 1))
+
+
+if __name__ == "__main__":
+    main()
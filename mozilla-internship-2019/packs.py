@@ -0,0 +1,173 @@
+'''
+Pack files for run outputs. A 100 run experiment used to leave tests × 100 small files in
+a single output dir, most of them byte for byte the same passing output. Instead every
+phase can append its outputs to
+
+    output_dir/outputs.pack   the distinct outputs, back to back
+    output_dir/outputs.idx    one line per output: name, offset, length, sha256
+
+where name is what the output file used to be called (test.replace('/', '_') + run).
+An output identical to one already in the pack is only added to the index. Both files
+are append only: an output written again, e.g. by a record retry, simply gets a new
+index line and the last one wins. A torn last index line, from a crash, is ignored and
+cut off the next time the pack is opened for writing.
+
+Outputs reads a dir whether it has a pack, loose output files or both, so analysers work
+on any output dir. To pack an existing dir of loose files:
+
+python3 packs.py pack output_dir/
+'''
+
+import hashlib
+import os
+import sys
+
+import wptreport
+
+usage = """\
+Usage: python3 packs.py pack output_dir/
+                        cat output_dir/ name
+                        ls output_dir/\
+"""
+
+pack_file = "outputs.pack"
+index_file = "outputs.idx"
+
+
+def read_index(output_dir):
+    """name -> (offset, length, sha256) of every complete line of the index."""
+    index = {}
+    path = output_dir + "/" + index_file
+    if not os.path.isfile(path):
+        return index
+    for line in open(path):
+        if not line.endswith("\n"):
+            break
+        (name, entry) = parse_index_line(line)
+        index[name] = entry
+    return index
+
+
+def parse_index_line(line):
+    """(name, (offset, length, sha256)) of a line of the index."""
+    (name, offset, length, sha) = line.rstrip("\n").split("\t")
+    return (name, (int(offset), int(length), sha))
+
+
+class Pack:
+    """
+    Appends outputs to the pack of `output_dir`. With `sync` every output is on disk
+    before add returns, so it can be journaled as finished.
+    """
+
+    def __init__(self, output_dir, sync=True):
+        self.output_dir = output_dir
+        self.sync = sync
+        os.makedirs(output_dir, exist_ok=True)
+        index_path = output_dir + "/" + index_file
+
+        self.index = read_index(output_dir)
+        # sha256 -> (offset, length) of every distinct output.
+        self.contents = {sha: (offset, length) for (offset, length, sha) in self.index.values()}
+
+        if os.path.isfile(index_path):
+            with open(index_path, "rb+") as fin:
+                data = fin.read()
+                if data != b"" and not data.endswith(b"\n"):
+                    fin.truncate(data.rfind(b"\n") + 1)
+        self.fpack = open(output_dir + "/" + pack_file, "ab")
+        self.findex = open(index_path, "a")
+
+    def add(self, name, contents):
+        sha = hashlib.sha256(contents).hexdigest()
+        if sha not in self.contents:
+            offset = self.fpack.seek(0, os.SEEK_END)
+            self.fpack.write(contents)
+            if self.sync:
+                self.fpack.flush()
+                os.fsync(self.fpack.fileno())
+            self.contents[sha] = (offset, len(contents))
+
+        (offset, length) = self.contents[sha]
+        self.index[name] = (offset, length, sha)
+        self.findex.write("{}\t{}\t{}\t{}\n".format(name, offset, length, sha))
+        if self.sync:
+            self.findex.flush()
+            os.fsync(self.findex.fileno())
+
+    def close(self):
+        self.fpack.close()
+        self.findex.close()
+
+
+class Outputs:
+    """The outputs of an output dir, packed or loose files."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.index = read_index(output_dir)
+        self.fpack = None
+        if self.index:
+            self.fpack = open(output_dir + "/" + pack_file, "rb")
+
+    def __contains__(self, name):
+        return name in self.index or os.path.isfile(self.output_dir + "/" + name)
+
+    def read(self, name):
+        """Contents of output `name`, None if there is no such output."""
+        if name in self.index:
+            (offset, length, _) = self.index[name]
+            self.fpack.seek(offset)
+            return self.fpack.read(length)
+        path = self.output_dir + "/" + name
+        if os.path.isfile(path):
+            return open(path, "rb").read()
+        return None
+
+    def close(self):
+        if self.fpack is not None:
+            self.fpack.close()
+
+
+def pack_dir(output_dir):
+    """
+    Move the loose output files of `output_dir` into its pack. Everything but the files
+    runs keep next to their outputs (wptreport.output_dir_files, .record and .record_fail
+    files, and files still being written) is taken to be an output.
+    """
+    kept = wptreport.output_dir_files + [pack_file, index_file]
+    pack = Pack(output_dir)
+    packed = 0
+    for name in sorted(os.listdir(output_dir)):
+        path = output_dir + "/" + name
+        if name in kept or name.endswith((".record", ".record_fail", wptreport.part_suffix,
+                                          wptreport.temp_suffix)) \
+                or not os.path.isfile(path):
+            continue
+        pack.add(name, open(path, "rb").read())
+        os.remove(path)
+        packed += 1
+    pack.close()
+    return (packed, len(pack.contents))
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "pack":
+        (packed, distinct) = pack_dir(sys.argv[2])
+        print("Packed {} outputs, {} distinct.".format(packed, distinct))
+    elif len(sys.argv) == 4 and sys.argv[1] == "cat":
+        contents = Outputs(sys.argv[2]).read(sys.argv[3])
+        if contents is None:
+            print("No output " + sys.argv[3])
+            sys.exit(1)
+        sys.stdout.buffer.write(contents)
+    elif len(sys.argv) == 3 and sys.argv[1] == "ls":
+        for (name, (offset, length, sha)) in sorted(Outputs(sys.argv[2]).index.items()):
+            print("{}\t{}\t{}".format(name, length, sha))
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+'''
+Spread a budget of runs over the whole suite, instead of giving 100 runs to every test of
+a hand picked list, and estimate the suite-wide flakiness from the result.
+
+`plan` stratifies the tests of tests_file by directory and by what earlier runs say about
+them (flaky, stable, always unexpected, or no history), and
+
+1. samples tests from every stratum in proportion to its size × the spread of its flake
+   rate (Neyman allocation), `min_runs` runs each, with `explore` of the budget,
+2. gives the rest of the budget one run at a time to the sampled test whose next run
+   shrinks the uncertainty of the suite-wide estimate most: the posterior variance of its
+   flake rate (Beta, from history and its planned runs) times its weight in the estimate.
+
+History is wptreport dirs or output dirs with a status_file. A run is flaky when it is
+unexpected (wptreport) or anything but SUCCEEDED (output dirs).
+
+The plan is a tab separated file of test, runs, stratum and weight, which experiment.py
+runs as a phase with "plan" instead of "tests". Once it ran, `estimate` gives every
+stratum's flake rate and the suite's, with standard errors:
+
+python3 plan_runs.py plan tests_file 5000 plan.tsv history_dir/... --min-runs 5
+python3 plan_runs.py estimate plan.tsv output_dir/...
+'''
+
+import argparse
+import heapq
+import math
+import os
+import random
+
+import classify
+import wptreport
+from classify import TestStatus
+
+# Flakiness classes of strata.
+flaky = "flaky"
+stable = "stable"
+failing = "failing"
+unknown = "unknown"
+
+
+def load_counts(dirs):
+    """test -> [runs, flaky runs] over every wptreport or output dir in `dirs`."""
+    counts = {}
+    for d in dirs:
+        if wptreport.is_wptreport_dir(d):
+            for json_file in wptreport.report_files(d):
+                for result in wptreport.load_results(json_file):
+                    count = counts.setdefault(result["test"], [0, 0])
+                    count[0] += 1
+                    count[1] += wptreport.is_unexpected(result)
+        elif os.path.isfile(d + "/" + classify.status_file):
+            for ((test, _), status) in classify.read_statuses(d).items():
+                if status == TestStatus.DOES_NOT_EXIST:
+                    continue
+                count = counts.setdefault(test, [0, 0])
+                count[0] += 1
+                count[1] += status != TestStatus.SUCCEEDED
+        else:
+            print("No wptreport files or {} in {}. Ignoring it.".format(
+                classify.status_file, d))
+    return counts
+
+
+def directory(test, depth):
+    """The first `depth` directories of `test`, "/css/css-grid" for depth 2."""
+    return "/".join(test.split("/")[:-1][:depth + 1])
+
+
+def flakiness(count):
+    if count is None or count[0] == 0:
+        return unknown
+    if count[1] == 0:
+        return stable
+    if count[1] == count[0]:
+        return failing
+    return flaky
+
+
+def stratify(tests, counts, depth):
+    """stratum name -> its tests."""
+    strata = {}
+    for test in tests:
+        name = directory(test, depth) + ":" + flakiness(counts.get(test))
+        strata.setdefault(name, []).append(test)
+    return strata
+
+
+def spread(tests, counts):
+    """Standard deviation of the flake rate of a stratum, 0.5 when nothing is known."""
+    runs = sum(counts[t][0] for t in tests if t in counts)
+    flakes = sum(counts[t][1] for t in tests if t in counts)
+    p = (flakes + 1) / (runs + 2)
+    return math.sqrt(p * (1 - p))
+
+
+def allocate(strata, counts, n):
+    """
+    Number of tests to sample from every stratum, `n` in total: at least one each when
+    there are enough, the rest in proportion to size × spread, largest remainder first.
+    """
+    names = sorted(strata)
+    sizes = {h: len(strata[h]) for h in names}
+    n = min(n, sum(sizes.values()))
+    sample = {h: 0 for h in names}
+    if n >= len(names):
+        sample = {h: 1 for h in names}
+    left = n - sum(sample.values())
+
+    weights = {h: sizes[h] * spread(strata[h], counts) for h in names}
+    while left > 0:
+        open_strata = [h for h in names if sample[h] < sizes[h]]
+        total = sum(weights[h] for h in open_strata)
+        shares = {h: left * weights[h] / total for h in open_strata}
+        given = 0
+        for h in open_strata:
+            extra = min(int(shares[h]), sizes[h] - sample[h])
+            sample[h] += extra
+            given += extra
+        if given == 0:
+            # Less than one test each, largest share first.
+            for h in sorted(open_strata, key=lambda h: -shares[h])[:left]:
+                sample[h] += 1
+                given += 1
+        left -= given
+    return sample
+
+
+def posterior(count, planned):
+    """(mean, variance) of a test's flake rate after its history and `planned` runs."""
+    (runs, flakes) = count if count is not None else (0, 0)
+    a = 1 + flakes
+    b = 1 + runs - flakes
+    p = a / (a + b)
+    return (p, p * (1 - p) / (a + b + planned + 1))
+
+
+def plan(tests, counts, budget, min_runs, max_runs, explore, depth, seed):
+    """[(test, runs, stratum, weight)] of the sampled tests."""
+    rng = random.Random(seed)
+    strata = stratify(tests, counts, depth)
+    sample = allocate(strata, counts, int(budget * explore) // min_runs)
+
+    runs = {}
+    weight = {}
+    stratum = {}
+    for (h, n) in sample.items():
+        for test in rng.sample(sorted(strata[h]), n):
+            runs[test] = min_runs
+            # Share of the suite this test stands for.
+            weight[test] = len(strata[h]) / n / len(tests)
+            stratum[test] = h
+
+    # Greedy: the next run goes to whichever test it helps most.
+    def gain(test):
+        (_, before) = posterior(counts.get(test), runs[test])
+        (_, after) = posterior(counts.get(test), runs[test] + 1)
+        return weight[test] ** 2 * (before - after)
+
+    left = budget - sum(runs.values())
+    heap = [(-gain(t), t) for t in runs if runs[t] < max_runs]
+    heapq.heapify(heap)
+    while left > 0 and heap:
+        (_, test) = heapq.heappop(heap)
+        runs[test] += 1
+        left -= 1
+        if runs[test] < max_runs:
+            heapq.heappush(heap, (-gain(test), test))
+
+    return [(t, runs[t], stratum[t], weight[t]) for t in sorted(runs)]
+
+
+def write_plan(plan_file, planned):
+    with open(plan_file, "w") as fout:
+        for (test, runs, stratum, weight) in planned:
+            fout.write("{}\t{}\t{}\t{}\n".format(test, runs, stratum, weight))
+
+
+def read_plan(plan_file):
+    planned = []
+    for line in open(plan_file):
+        (test, runs, stratum, weight) = line.rstrip("\n").split("\t")
+        planned.append((test, int(runs), stratum, float(weight)))
+    return planned
+
+
+def estimate(planned, counts):
+    """
+    stratum -> (tests run, flake rate, standard error), and the suite's
+    (flake rate, standard error). A stratum's rate is the mean of its tests' rates.
+    """
+    rates = {}
+    weights = {}
+    for (test, _, stratum, weight) in planned:
+        count = counts.get(test)
+        if count is None or count[0] == 0:
+            continue
+        rates.setdefault(stratum, []).append(count[1] / count[0])
+        weights[stratum] = weights.get(stratum, 0) + weight
+
+    strata = {}
+    suite = 0
+    suite_var = 0
+    for (stratum, values) in rates.items():
+        n = len(values)
+        mean = sum(values) / n
+        var = sum((v - mean) ** 2 for v in values) / (n - 1) if n > 1 else mean * (1 - mean)
+        strata[stratum] = (n, mean, math.sqrt(var / n))
+        # Every tested test of the stratum stands for the same share of the suite.
+        suite += weights[stratum] * mean
+        suite_var += weights[stratum] ** 2 * var / n
+    total = sum(weights.values())
+    if total == 0:
+        return (strata, None)
+    return (strata, (suite / total, math.sqrt(suite_var) / total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan runs of a sample of the suite.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = p = sub.add_parser("plan")
+    p.add_argument("tests_file")
+    p.add_argument("budget", type=int, help="Total number of runs.")
+    p.add_argument("plan_file")
+    p.add_argument("history", nargs="*", help="wptreport or output dirs.")
+    p.add_argument("--min-runs", type=int, default=5)
+    p.add_argument("--max-runs", type=int, default=100)
+    p.add_argument("--explore", type=float, default=0.5,
+                   help="Share of the budget for sampling tests, the rest goes to the "
+                        "most uncertain ones.")
+    p.add_argument("--depth", type=int, default=2, help="Directories per stratum.")
+    p.add_argument("--seed", type=int, default=None)
+
+    p = sub.add_parser("estimate")
+    p.add_argument("plan_file")
+    p.add_argument("results", nargs="+", help="wptreport or output dirs of the plan's runs.")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        if args.min_runs < 1:
+            plan_parser.error("--min-runs must be at least 1")
+        if int(args.budget * args.explore) < args.min_runs:
+            plan_parser.error("a budget of {} runs, {} of it to explore, can't give even one "
+                              "test its {} runs".format(args.budget, args.explore, args.min_runs))
+        tests = wptreport.read_tests(args.tests_file)
+        counts = load_counts(args.history)
+        planned = plan(tests, counts, args.budget, args.min_runs, args.max_runs, args.explore,
+                       args.depth, args.seed)
+        write_plan(args.plan_file, planned)
+
+        print("stratum, tests, sampled, runs")
+        strata = stratify(tests, counts, args.depth)
+        for h in sorted(strata):
+            mine = [p for p in planned if p[2] == h]
+            print("{}, {}, {}, {}".format(h, len(strata[h]), len(mine),
+                                          sum(p[1] for p in mine)))
+        print("Planned {} runs of {}/{} tests in {}.".format(
+            sum(p[1] for p in planned), len(planned), len(tests), args.plan_file))
+    else:
+        (strata, suite) = estimate(read_plan(args.plan_file), load_counts(args.results))
+        print("stratum, tests, flake_rate, stderr")
+        for (h, (n, rate, stderr)) in sorted(strata.items()):
+            print("{}, {}, {:.4f}, {:.4f}".format(h, n, rate, stderr))
+        if suite is not None:
+            print("suite, {}, {:.4f}, {:.4f}".format(
+                sum(n for (n, _, _) in strata.values()), suite[0], suite[1]))
+
+
+if __name__ == "__main__":
+    main()
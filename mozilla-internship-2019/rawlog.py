@@ -0,0 +1,116 @@
+'''
+Status of a run from mach's raw structured log (mozlog JSON lines, `--log-raw`), rather
+than from the text it prints. One event per line, read as a stream:
+
+- log ERROR "Unable to find any tests at the path": DOES_NOT_EXIST
+- no test_end: UNKNOWN, the run never finished
+- a test_end or test_status with an "expected" its status isn't a known intermittent of,
+  i.e. an unexpected result: TIMEDOUT if the test itself timed out, else FAILED
+- otherwise: SUCCEEDED
+
+Same statuses classify.py works out from the text output, which mach is free to reformat.
+A test_end with status CRASH or a crash event marks the run as crashed.
+
+With "raw_log" experiment.py phases have mach write it next to every output, use it for
+their status_file and keep it as the output's name + ".mozlog".
+
+python3 rawlog.py test_name raw_log_file
+'''
+
+import json
+import sys
+
+from classify import TestStatus
+
+usage = "Usage: python3 rawlog.py test_name raw_log_file"
+
+# Name of a run's raw log: its output's name with this suffix.
+suffix = ".mozlog"
+
+
+def events(lines):
+    """Parsed events of raw log `lines`, str or bytes. Lines which aren't json are skipped."""
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # Torn last line of a killed run, or something else writing to the log.
+            continue
+        if isinstance(event, dict) and "action" in event:
+            yield event
+
+
+def unexpected(event):
+    return "expected" in event \
+        and event.get("status") not in event.get("known_intermittent", [])
+
+
+class RunReader:
+    """Fed a run's raw log event by event."""
+
+    def __init__(self, test_name):
+        self.test_name = test_name
+        self.does_not_exist = False
+        self.ended = False
+        self.unexpected = False
+        self.timedout = False
+        self.crashed = False
+        # Signatures, or messages, of the crashes seen.
+        self.crashes = []
+
+    def feed(self, lines):
+        for event in events(lines):
+            self.event(event)
+
+    def event(self, event):
+        action = event["action"]
+        if action == "log" and event.get("level") == "ERROR" \
+                and "Unable to find any tests at the path" in event.get("message", ""):
+            self.does_not_exist = True
+        elif action == "test_status":
+            self.unexpected = self.unexpected or unexpected(event)
+        elif action == "test_end":
+            self.ended = True
+            if unexpected(event):
+                self.unexpected = True
+                self.timedout = self.timedout or event.get("status") == "TIMEOUT"
+            if event.get("status") == "CRASH":
+                self.crashed = True
+                self.crashes.append(event.get("message") or event.get("test", "crash"))
+        elif action == "crash":
+            self.crashed = True
+            self.crashes.append(event.get("signature") or event.get("reason") or "crash")
+
+    def status(self):
+        if self.does_not_exist:
+            return TestStatus.DOES_NOT_EXIST
+        if not self.ended:
+            return TestStatus.UNKNOWN
+        if not self.unexpected:
+            return TestStatus.SUCCEEDED
+        if self.timedout:
+            return TestStatus.TIMEDOUT
+        return TestStatus.FAILED
+
+
+def classify(test_name, contents):
+    """(status, crashed) of a run from its raw log, like classify.classify."""
+    reader = RunReader(test_name)
+    reader.feed(contents.splitlines())
+    return (reader.status(), reader.crashed)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(usage)
+        sys.exit(1)
+    reader = RunReader(sys.argv[1])
+    with open(sys.argv[2], "rb") as fin:
+        reader.feed(fin)
+    print(reader.status().name)
+    for crash in reader.crashes:
+        print("crash: " + crash)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,32 @@ This script should NOT be used. Running multiple instances of Servo at once make
 server sad. Instead tests should be executed in bulk using --log-wptreport and feeding a list of tests to mach via
 command line (there might be a way to do this via a file as well.
 '''
-import subprocess
+import json
 import sys
 import os
+import time
+
+import classify
+import durations
+import experiment
+import job_control
+import packs
+import rawlog
+import watch
+import wpt_manifest
+import wptreport
+from classify import TestStatus
+from telemetry import Telemetry
 
 usage = """\
 Usage: python3 this.py run_baseline         tests_file output_dir/
                        analyse_output       tests_file baseline_results/
+                       watch_output         tests_file output_dir/ [results.csv]
                        record_tests         tests_file output_dir/
                        run_replay           tests_file output_dir/ record_dir/
-                       analyse_do_not_exist tests_file results/\
+                       record_and_replay    tests_file output_dir/ record_dir/
+                       analyse_do_not_exist tests_file results/
+                       analyse_rusage       tests_file output_dir/ [other_output_dir/]\
 
 run_baseline: Use test_file to run baseline results. Produces `concurrent_processes`
               number of files. Where the file name is `output_dir` + the test's name.
@@ -20,17 +36,52 @@ run_baseline: Use test_file to run baseline results. Produces `concurrent_proces
               The files can later be analysed via analyse_output.
               Skips any files which have already been generated in previous runs.
               Generates a timeout file in `output_dir`. On `analyse_output` these
-              timedout results are treated as "rig_timeout"
+              timedout results are treated as "rig_timeout". Runs killed for going
+              silent for `inactivity_timeout` seconds are listed in a hang file and
+              counted as "hang".
 
 analyse_output: Used to crunch number of success, failures, timeout, test does not exit,
                 etc. From the output of `run_baseline` or `run_replay`. Errors if a
                 specified test in `test_file` is missing. Uses timeout file to
                 count some tests executions as "rig_timeout"
 
-record_tests: Loops `test_runs` number of times trying to record a successful execution
-              of the test runs. Generates the output file of the record, the record file,
-              or gives up after `test_runs` times leaving behind the test output and a
-              record_fail file.
+watch_output: analyse_output for an output dir which is still being written to. Watches
+              it (inotify, or polling where there is none), classifies every run once
+              as its status, timeout, hang or output shows up, and every
+              `watch_interval` seconds writes the analyse_output CSV to results.csv
+              (default output_dir/live_results.csv) and prints a summary, also kept in
+              live_summary.txt next to it. Stops once every run is in, or on ctrl-c.
+
+record_tests: Retries each test up to `test_runs` number of times trying to record a
+              successful execution. Generates the output file of the record, the record
+              file, or gives up after `test_runs` times leaving behind the test output and
+              a record_fail file.
+
+record_and_replay: record_tests into `record_dir` and run_replay into `output_dir` at the
+                   same time. A test's replays start as soon as it has been recorded,
+                   sharing the `concurrent_processes` slots with the remaining recordings.
+
+analyse_rusage: Average CPU time, max RSS and context switches per test from the
+                `rusage_file` every run writes. Given a second output dir (e.g. baseline
+                and replay) prints the mean wall time in ms of both instead, in the
+                format of report/timing_results_to_graph.txt.
+
+run_baseline, record_tests, run_replay and record_and_replay run every test in its own process group. On
+timeout the whole group gets SIGTERM, then SIGKILL after `job_control.kill_grace_period`
+seconds. Processes leaked by a previous runner using the same output_dir are killed on
+startup, and everything still running is killed when the runner exits.
+
+They also log every spawn, finish, timeout and record failure to `telemetry_events_file`
+and keep `telemetry_textfile` (Prometheus textfile format) up to date in `output_dir`.
+
+These modes run a single phase of experiment.py, which runs whole baseline + record +
+replay experiments from a spec file.
+
+With `pack_outputs` the output "files" are appended to a pack file in the output dir
+instead, storing identical outputs once. The analyse modes read both. See packs.py.
+
+With `raw_log` mach also writes its raw structured log for every run, which decides the
+run's status instead of the text mach prints. See rawlog.py.
 """
 
 mach_command = "./mach test-wpt --headless --release "
@@ -39,16 +90,39 @@ mach_command = "./mach test-wpt --headless --release "
 concurrent_processes = 1
 # Number of times to run each individual test.
 test_runs = 100
-
-from enum import Enum
-class TestStatus(Enum):
-    DOES_NOT_EXIST = 1
-    FAILED = 2
-    SUCCEEDED = 3
-    # The servo test returned with timeout.
-    TIMEDOUT = 4
-    # Didn't look like a regular fail.
-    UNKNOWN = 5
+# wptreport or output dirs of earlier runs. If given, tests with the longest expected
+# duration are run first. See durations.py.
+duration_history = []
+# With duration_history, give every run a timeout derived from its test's durations and
+# mode instead of the fixed one. See durations.AdaptiveTimeouts.
+adaptive_timeouts = False
+# Seconds a run may print nothing before it is killed as hung, instead of holding its slot
+# until the timeout. Must be longer than the slowest test is silent. None to disable.
+inactivity_timeout = None
+# WPT MANIFEST.json files, e.g. tests/wpt/metadata/MANIFEST.json. If given, tests in none
+# of them are never run, but listed in output_dir/tests_that_no_longer_exist.txt.
+wpt_manifests = []
+# Append outputs to a pack file in the output dir instead of writing a file per run.
+# See packs.py.
+pack_outputs = True
+# Have mach write its raw structured log next to every output (--log-raw) and take the
+# status of every run from it instead of from the text mach prints. See rawlog.py.
+raw_log = False
+# Pin each of the concurrent_processes slots to its own CPUs: True to split our CPUs
+# evenly, or a list of CPU lists. Niceness and ionice (class, level) of every run, None to
+# leave them alone. The pinning of every run is in the journal of its output dir.
+cpu_affinity = False
+nice = None
+ionice = None
+
+# Runner telemetry, written to `output_dir`. Set to None to disable.
+# JSON-lines log of every spawn, finish, timeout and record failure.
+telemetry_events_file = wptreport.telemetry_events_file
+# Prometheus textfile with running totals, rewritten every `telemetry_interval` seconds.
+telemetry_textfile = wptreport.telemetry_textfile
+telemetry_interval = 15
+# Seconds between the CSVs and summaries watch_output writes.
+watch_interval = 10
 
 class Results:
     """Result for a given test"""
@@ -62,6 +136,8 @@ class Results:
     timedout = 0
     # The testing rig timed out on this test. The test didn't return timeout.
     rig_timeout = 0
+    # The test stopped printing anything for `inactivity_timeout` and was killed.
+    hang = 0
     # Didn't look like a regular fail.
     unknown = 0
 
@@ -77,7 +153,7 @@ def main():
     test_file = sys.argv[2]
     output_dir = sys.argv[3]
 
-    timeout_file = output_dir + "/" + "timeout_file"
+    timeout_file = output_dir + "/" + experiment.timeout_file
 
     if not os.path.isdir(output_dir):
         print(output_dir + " is not a dir")
@@ -91,12 +167,31 @@ def main():
     for line in fin:
         tests.append(line.rstrip())
 
+    if mode in ["run_baseline", "record_tests", "run_replay", "record_and_replay"]:
+        try:
+            experiment.check_cpu_affinity(cpu_affinity, concurrent_processes)
+            experiment.check_priorities(nice, ionice)
+        except ValueError as e:
+            print("Invalid run settings: {}".format(e))
+            sys.exit(1)
+        job_control.start(output_dir)
+        if wpt_manifests != []:
+            known = wpt_manifest.load_known_tests(wpt_manifests)
+            tests = wpt_manifest.preflight(tests, known, output_dir)
+
     if mode == "run_baseline":
-        run_baseline(output_dir, timeout_file, tests)
+        telemetry = open_telemetry(output_dir)
+        run_baseline(output_dir, tests, telemetry)
+        telemetry.close()
     elif mode == "analyse_output":
         analyse_output(output_dir, timeout_file, tests)
+    elif mode == "watch_output":
+        csv_file = sys.argv[4] if len(sys.argv) == 5 else output_dir + "/" + wptreport.live_results_file
+        watch_output(output_dir, tests, csv_file)
     elif mode == "record_tests":
-        record_tests(output_dir, tests)
+        telemetry = open_telemetry(output_dir)
+        record_tests(output_dir, tests, telemetry)
+        telemetry.close()
     elif mode == "analyse_do_not_exist":
         analyse_do_not_exist(output_dir, tests)
     elif mode == "run_replay":
@@ -105,85 +200,60 @@ def main():
             sys.exit(1)
 
         record_dir = sys.argv[4]
-        run_replay(output_dir, timeout_file, record_dir, tests)
+        telemetry = open_telemetry(output_dir)
+        run_replay(output_dir, record_dir, tests, telemetry)
+        telemetry.close()
+    elif mode == "record_and_replay":
+        if len(sys.argv) != 5:
+            print(usage)
+            sys.exit(1)
+
+        record_dir = sys.argv[4]
+        if not os.path.isdir(record_dir):
+            print(record_dir + " is not a dir")
+            sys.exit(1)
+        telemetry = open_telemetry(output_dir)
+        record_and_replay(output_dir, record_dir, tests, telemetry)
+        telemetry.close()
+    elif mode == "analyse_rusage":
+        analyse_rusage(tests, sys.argv[3:])
     else:
         print("Unknown mode: " + mode)
         sys.exit(1)
 
-def run_baseline(output_dir, timeout_file, tests):
-    run_tests(output_dir, timeout_file, None, tests, False)
-
-def run_tests(output_dir, timeout_file, record_dir, tests, is_replay):
-    # Append entries to timeout file
-    fout_timeout = open(timeout_file, "a")
-
-    running_procs = []
-
-    for test in tests:
-        print("Running test: " + test)
-        test_path = test
-
-        for i in range(0, test_runs):
-            # Write output to file.
-            write_file = output_dir + "/" + test.replace('/', '_') + str(i)
-
-            # File already exists, skip it!
-            if os.path.isfile(write_file):
-                print("Output file! {} Skipping.".format(write_file))
-                continue
-
-            env = os.environ
-
-            if is_replay:
-                record_prefix = record_dir + "/" + test.replace('/', '_')
-                record_fail_file = record_prefix + ".record_fail"
-                record_file = record_prefix + ".record"
-
-                if not os.path.isfile(record_file) and not os.path.isfile(record_fail_file):
-                    print("Record files do not exist for {}. Skipping".format(test))
-                    continue
-
-                # Set up experiment for replay
-                env["RR_CHANNEL"] = "replay"
-                env["RR_RECORD_FILE"] = record_file
-
-            fout = open(write_file, "wb")
-            print("Command: " + mach_command + test)
-            rp = subprocess.Popen(mach_command + test,
-                                  shell=True, stdout=fout, env=env)
-
-            print("Spawned {} tests.".format(i))
-            running_procs.append((rp, test, write_file, i))
-
-            if len(running_procs) == concurrent_processes:
-                print("Switching to waiting for tests to finish...")
-                wait_for_procs_finish(running_procs, fout_timeout)
-
-    # Handle tail of tests left over.
-    wait_for_procs_finish(running_procs, fout_timeout)
-
-def wait_for_procs_finish(running_procs, fout_timeout):
-    '''
-    Wait for running tests to finish. Try figuring out why they failed
-    based on their output and fill entries in results.
-    Clears running_procs after it is done.
-    '''
-    for (rp, test_name, write_file, test_num) in running_procs:
-        # For now just wait. Later we might wanna poll.
-        # print(str(test_num) + " " + test_name + "... ", end="")
-        # sys.stdout.flush()
-
-        # give up if it takes longer than N seconds.
-        try:
-            returncode = rp.wait(timeout=30)
-        except:
-            print("Test timed out: " + test_name + str(test_num))
-            if not fout_timeout is None:
-                fout_timeout.write(test_name + str(test_num) + "\n")
-            continue
-
-    # Remove entries.
-    running_procs.clear()
+def open_telemetry(output_dir):
+    events_file = None
+    if telemetry_events_file is not None:
+        events_file = output_dir + "/" + telemetry_events_file
+    textfile = None
+    if telemetry_textfile is not None:
+        textfile = output_dir + "/" + telemetry_textfile
+    return Telemetry(events_file, textfile, telemetry_interval, concurrent_processes)
+
+def run_baseline(output_dir, tests, telemetry):
+    # Give up on a run if it takes longer than 30 seconds.
+    phase = experiment.Phase("baseline", "baseline", tests, test_runs, 30, output_dir,
+                             pack_outputs=pack_outputs,
+                             inactivity_timeout=inactivity_timeout, raw_log=raw_log)
+    run_phase(phase, output_dir, telemetry)
+
+def run_phase(phase, output_dir, telemetry):
+    run_phases([phase], output_dir, telemetry)
+
+def run_phases(phases, output_dir, telemetry):
+    """Run phases of jobs with the same engine experiment.py uses."""
+    jobs = experiment.compile_jobs(phases, mach_command, os.environ)
+    if duration_history != []:
+        overhead = durations.adaptive_defaults["overhead"] if adaptive_timeouts else None
+        history = durations.load_history(duration_history, overhead)
+        jobs = experiment.order_jobs(jobs, history)
+        if adaptive_timeouts:
+            experiment.set_timeouts(jobs, history, {})
+    for phase in phases:
+        phase.cpu_affinity = cpu_affinity
+        phase.nice = nice
+        phase.ionice = ionice
+    experiment.Engine(phases, jobs, concurrent_processes, telemetry, output_dir).run()
 
 def analyse_output(output_dir, timeout_file, tests):
     if not os.path.isfile(timeout_file):
@@ -194,17 +264,22 @@ def analyse_output(output_dir, timeout_file, tests):
     timeouts = set()
     for line in timeout_fin:
         timeouts.add(line.rstrip())
+    hangs = read_hangs(output_dir)
+    # Classified while the runs were captured, their outputs need not be read again.
+    statuses = classify.read_statuses(output_dir)
 
     # Hashmap of results so far.
     results = {}
+    outputs = packs.Outputs(output_dir)
 
     for test in tests:
         results[test] = Results(test)
 
         for i in range(0, test_runs):
             read_file = output_dir + "/" + test.replace('/', '_') + str(i)
+            name = test.replace('/', '_') + str(i)
 
-            if not os.path.isfile(read_file):
+            if name not in outputs:
                 print("No such file: " + read_file + " skipping!")
                 continue
 
@@ -212,8 +287,14 @@ def analyse_output(output_dir, timeout_file, tests):
             # Don't bother analysing if test timed out.
             if test + str(i) in timeouts:
                 results[test].rig_timeout += 1
+            elif test + str(i) in hangs:
+                results[test].hang += 1
             else:
-                status = analyse_file(test, i, read_file)
+                status = statuses.get((test, i))
+                if status is None and name + rawlog.suffix in outputs:
+                    status = rawlog.classify(test, outputs.read(name + rawlog.suffix))[0]
+                if status is None:
+                    status = analyse_contents(test, outputs.read(name), read_file)
 
                 if status == TestStatus.DOES_NOT_EXIST:
                     results[test].does_not_exist += 1
@@ -227,14 +308,185 @@ def analyse_output(output_dir, timeout_file, tests):
                     results[test].rig_timeout += 1
 
     # Header
-    print("name, does_not_exist, failed, succeeded, timedout, unknown, rig_timeout, total")
+    print("name, does_not_exist, failed, succeeded, timedout, unknown, rig_timeout, hang, total")
     for r in results.values():
-        print("{}, {}, {}, {}, {}, {}, {}, {}".format(r.name, r.does_not_exist, r.failed, r.succeeded, r.timedout, r.unknown, r.rig_timeout, r.total))
+        print("{}, {}, {}, {}, {}, {}, {}, {}, {}".format(r.name, r.does_not_exist, r.failed, r.succeeded, r.timedout, r.unknown, r.rig_timeout, r.hang, r.total))
+
+class LiveResults:
+    """
+    Results of an output dir, run by run as they come in. A run's status can still be
+    overruled by its timeout or hang, which phases write after it, and only its journal
+    finish or skip entry, written last, says it is final. Tests the manifests dropped never
+    run at all.
+    """
+
+    # Results field of every status, as analyse_output counts them.
+    fields = {TestStatus.DOES_NOT_EXIST: "does_not_exist", TestStatus.FAILED: "failed",
+              TestStatus.SUCCEEDED: "succeeded", TestStatus.TIMEDOUT: "timedout",
+              TestStatus.UNKNOWN: "rig_timeout"}
+
+    def __init__(self, tests):
+        self.results = {}
+        # Output name -> (test, run), and (test, run) -> Results field it is counted in.
+        self.runs = {}
+        self.counted = {}
+        # (test, run) of the runs the journal says are finished or skipped.
+        self.finished = set()
+        # Tests in wptreport.missing_tests_file.
+        self.missing = set()
+        for test in tests:
+            self.results[test] = Results(test)
+            for i in range(0, test_runs):
+                self.runs[test.replace('/', '_') + str(i)] = (test, i)
+
+    def count(self, test, i, field):
+        if test not in self.results or self.counted.get((test, i)) == field:
+            return
+        r = self.results[test]
+        if (test, i) in self.counted:
+            previous = self.counted[(test, i)]
+            setattr(r, previous, getattr(r, previous) - 1)
+        else:
+            r.total += 1
+        setattr(r, field, getattr(r, field) + 1)
+        self.counted[(test, i)] = field
+
+    def status(self, test, i, status):
+        # Timeouts and hangs have the last word.
+        if self.counted.get((test, i)) not in ["rig_timeout", "hang"]:
+            self.count(test, i, self.fields[status])
+
+    def output(self, name, contents):
+        """A run's output, only classified if its status wasn't written."""
+        if name in self.runs and self.runs[name] not in self.counted:
+            (test, i) = self.runs[name]
+            self.count(test, i, self.fields[classify.classify(test, contents)[0]])
+
+    def write_csv(self, csv_file):
+        lines = ["name, does_not_exist, failed, succeeded, timedout, unknown, rig_timeout, "
+                 "hang, total"]
+        for r in self.results.values():
+            lines.append("{}, {}, {}, {}, {}, {}, {}, {}, {}".format(r.name, r.does_not_exist, r.failed, r.succeeded, r.timedout, r.unknown, r.rig_timeout, r.hang, r.total))
+        experiment.write_atomically(csv_file, ("\n".join(lines) + "\n").encode())
+
+    def summary(self):
+        results = self.results.values()
+        runs = sum(r.total for r in results)
+        failed = sum(r.failed for r in results)
+        flaky = sum(1 for r in results if r.succeeded != 0 and r.failed + r.timedout != 0)
+        return ("{}/{} runs, succeeded {}, failed {}, timedout {}, rig_timeout {}, hang {}, "
+                "does_not_exist {}. Flaky tests {}/{}, fail rate {:.2%}".format(
+                    runs, len(self.runs), sum(r.succeeded for r in results), failed,
+                    sum(r.timedout for r in results), sum(r.rig_timeout for r in results),
+                    sum(r.hang for r in results), sum(r.does_not_exist for r in results),
+                    flaky, len(self.results), failed / runs if runs != 0 else 0))
+
+    def complete(self, journaled):
+        """Every run is final. Without a journal, `journaled` False, every run is counted."""
+        if journaled:
+            return all(run in self.finished or run[0] in self.missing
+                       for run in self.runs.values())
+        return len(self.counted) == len(self.runs)
+
+
+def watch_output(output_dir, tests, csv_file):
+    live = LiveResults(tests)
+    status_tail = watch.Tail(output_dir + "/" + experiment.status_file)
+    timeout_tail = watch.Tail(output_dir + "/" + experiment.timeout_file)
+    hang_tail = watch.Tail(output_dir + "/" + experiment.hang_file)
+    index_tail = watch.Tail(output_dir + "/" + packs.index_file)
+    journal_tail = watch.Tail(output_dir + "/" + experiment.journal_file)
+    summary_file = os.path.dirname(os.path.abspath(csv_file)) + "/" \
+        + wptreport.live_summary_file
+    own_files = [os.path.basename(csv_file), os.path.basename(summary_file)]
+
+    def write():
+        live.write_csv(csv_file)
+        summary = live.summary()
+        experiment.write_atomically(summary_file, (summary + "\n").encode())
+        print(summary)
+
+    watcher = watch.Watcher(output_dir)
+    if watcher.fd is None:
+        print("No inotify, polling " + output_dir)
+    last_write = 0
+    try:
+        while True:
+            names = watcher.changes(1)
+            names.difference_update(own_files)
+            # A run's status is written before its output is packed or renamed into
+            # place, timeouts and hangs after it, and its journal entry last.
+            if experiment.journal_file in names:
+                for line in journal_tail.lines():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry["event"] in ["finish", "skip"]:
+                        live.finished.add((entry["test"], entry["run"]))
+            if wptreport.missing_tests_file in names:
+                live.missing = set(wptreport.read_tests(output_dir + "/" +
+                                                        wptreport.missing_tests_file))
+            journaled = os.path.isfile(journal_tail.path)
+            done = journaled and live.complete(journaled)
+            if done:
+                # Whatever was written before the last finish entry, read it all.
+                names.update([experiment.status_file, packs.index_file,
+                              os.path.basename(timeout_tail.path),
+                              os.path.basename(hang_tail.path)])
+            if experiment.status_file in names:
+                for line in status_tail.lines():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    live.status(entry["test"], entry["run"], TestStatus[entry["status"]])
+            if packs.index_file in names:
+                lines = index_tail.lines()
+                if lines != []:
+                    with open(output_dir + "/" + packs.pack_file, "rb") as fpack:
+                        for line in lines:
+                            (name, (offset, length, _)) = packs.parse_index_line(line)
+                            if name in live.runs and live.runs[name] not in live.counted:
+                                fpack.seek(offset)
+                                live.output(name, fpack.read(length))
+            for name in names:
+                if name in live.runs and live.runs[name] not in live.counted:
+                    live.output(name, open(output_dir + "/" + name, "rb").read())
+            for (tail, field) in [(timeout_tail, "rig_timeout"), (hang_tail, "hang")]:
+                if os.path.basename(tail.path) in names:
+                    for line in tail.lines():
+                        run = live.runs.get(line.replace('/', '_'))
+                        if run is not None:
+                            live.count(run[0], run[1], field)
+
+            done = live.complete(journaled)
+            if done or time.time() - last_write > watch_interval:
+                last_write = time.time()
+                write()
+            if done:
+                break
+    except KeyboardInterrupt:
+        write()
+    watcher.close()
+
+def read_hangs(output_dir):
+    """Runs killed for going silent. Older output dirs have no hang file."""
+    hangs = set()
+    hang_file = output_dir + "/" + experiment.hang_file
+    if os.path.isfile(hang_file):
+        for line in open(hang_file):
+            hangs.add(line.rstrip())
+    return hangs
 
 
 
 def analyse_file(test_name, test_num, read_file):
-    contents = open(read_file, "rb").read().rstrip().split(b'\n')
+    return analyse_contents(test_name, open(read_file, "rb").read(), read_file)
+
+def analyse_contents(test_name, contents, read_file):
+    """Status of a run from its output `contents`. `read_file` names it in messages."""
+    contents = contents.rstrip().split(b'\n')
     try:
         no_such_test_line = contents[1]
     except:
@@ -262,113 +514,99 @@ def analyse_file(test_name, test_num, read_file):
     print("Unknown status in: " + read_file)
     return TestStatus.UNKNOWN
 
-def record_tests(output_dir, tests):
-
-    # Break up all tests into N size chunks to run at a time.
-    test_chunks = chunks(tests, concurrent_processes)
-
-    for chunk in test_chunks:
-        run_until_record_or_fail(set(chunk), output_dir)
-
-
-def run_until_record_or_fail(test_batch, output_dir):
+def record_tests(output_dir, tests, telemetry):
     """
-    Warning! This function will spawn as many processes as tests passed in.
-    Ensure you're not passing too many...
-
-    Runs all the passed tests until they all succeed or fail 10 times.
+    Runs all the passed tests until they all succeed or fail `test_runs` times.
     Creates a test_name + .record file on success, or .record_fail file on failure.
     """
-    test_batch_temp = test_batch.copy()
-    for test in test_batch_temp:
-        write_file = output_dir + "/" + test.replace('/', '_')
-        record_file = write_file + ".record"
-        record_fail_file = write_file + ".record_fail"
-        if os.path.isfile(record_file) or os.path.isfile(record_fail_file):
-            print("Skipping ", test)
-            test_batch.remove(test)
-
-    test_batch = test_batch.copy()
-
-    # Try to record a test N times.
-    for i in range(test_runs):
-        live_procs = []
-
-        print("[{}] Trying to run {} tests".format(i, len(test_batch)))
-
-        # Spawn a process per test.
-        for test in test_batch:
-            # Write output to file.
-            write_file = output_dir + "/" + test.replace('/', '_')
-            record_file = write_file + ".record"
-            record_fail_file = write_file + ".record_fail"
-
-            env = os.environ
-            env["RR_CHANNEL"] = "record"
-            env["RR_RECORD_FILE"] = record_file
-
-            fout = open(write_file, "wb")
-            test_path = test
-            rp = subprocess.Popen(mach_command + test_path, shell=True, stdout=fout, env=env)
-            live_procs.append((test, rp))
-
-        # Wait for processes to finish. And if they succeeded, removed them from test_batch.
-        for (test_name, rp) in live_procs:
-            print("Waiting for {} to finish... ".format(test_name), end="")
-            sys.stdout.flush()
-
-            try:
-                returncode = rp.wait(timeout=20)
-            except:
-                print("Test timed out: " + test_name + " ", end="")
-                returncode = 1
-
-            if returncode == 0:
-                print("Record succeeded.")
-                # careful not to remove entries while iterating over test_batch
-                test_batch.remove(test_name)
-                # Remove record fail file if previous iteration failed.
-                remove_file(record_fail_file)
+    phase = experiment.Phase("record", "record", tests, test_runs, 20, output_dir,
+                             pack_outputs=pack_outputs,
+                             inactivity_timeout=inactivity_timeout, raw_log=raw_log)
+    run_phase(phase, output_dir, telemetry)
+
+
+def analyse_rusage(tests, output_dirs):
+    averages = [average_rusage(d) for d in output_dirs]
+
+    if len(averages) == 1:
+        fields = ["wall", "user", "sys", "max_rss",
+                  "voluntary_ctx_switches", "involuntary_ctx_switches"]
+        print("name, runs, " + ", ".join(fields))
+        for test in tests:
+            if test not in averages[0]:
+                print("No resource usage for " + test + " skipping!")
+                continue
+            (runs, average) = averages[0][test]
+            print("{}, {}, ".format(test, runs) + ", ".join(str(average[f]) for f in fields))
+    else:
+        for test in tests:
+            if test not in averages[0] or test not in averages[1]:
+                print("No resource usage for " + test + " skipping!")
+                continue
+            print("{}\t{}\t{}".format(test, averages[0][test][1]["wall"] * 1000,
+                                      averages[1][test][1]["wall"] * 1000))
 
-            else:
-                print("Record failed.")
-                # Remove record file. It is garbage.
-                remove_file(record_file)
-                fout = open(record_fail_file, "w")
-                fout.write("failed")
-
-        # We're all done!
-        if len(test_batch) == 0:
-            return
+def average_rusage(output_dir):
+    """
+    test name -> (runs, {field -> mean}) over every run in `rusage_file` that exited.
+    Runs the rig timed out have no resource usage and are skipped.
+    """
+    read_file = output_dir + "/" + experiment.rusage_file
+    if not os.path.isfile(read_file):
+        print("File " + read_file + " does not exist. Have you ran run_baseline?")
+        sys.exit(1)
+
+    # A run interrupted after writing its entry, but before it was journaled as finished,
+    # is run again. Only count its last entry.
+    entries = {}
+    for line in open(read_file):
+        entry = json.loads(line)
+        entries[(entry["test"], entry["run"], entry["mode"])] = entry
 
-    # These entries where never successfully recorded.
-    for t in test_batch:
-        print("Unable to record after {} tries {}".format(test_runs, t))
+    totals = {}
+    for entry in entries.values():
+        if entry["returncode"] is None:
+            continue
+        (runs, total) = totals.get(entry["test"], (0, {}))
+        for (field, value) in entry.items():
+            if field not in ["test", "run", "mode", "returncode"]:
+                total[field] = total.get(field, 0) + value
+        totals[entry["test"]] = (runs + 1, total)
 
+    averages = {}
+    for (test, (runs, total)) in totals.items():
+        averages[test] = (runs, {f: v / runs for (f, v) in total.items()})
+    return averages
 
 def analyse_do_not_exist(output_dir, tests):
     """
     Check the output files and find all tests that do not exist.
     """
+    outputs = packs.Outputs(output_dir)
     for test in tests:
         read_file = output_dir + "/" + test.replace('/', '_') + str(0)
-        if os.path.isfile(read_file):
-            if analyse_file(test, 0, read_file) == TestStatus.DOES_NOT_EXIST:
+        contents = outputs.read(test.replace('/', '_') + str(0))
+        if contents is not None:
+            if analyse_contents(test, contents, read_file) == TestStatus.DOES_NOT_EXIST:
                 print("Does not exist: ", test)
         else:
             print("This test has never been run", test)
 
-def run_replay(output_dir, timeout_file, record_dir, tests):
-    run_tests(output_dir, timeout_file, record_dir, tests, True)
-
-# https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
-
-def remove_file(path):
-    if os.path.isfile(path):
-        os.remove(path)
-
-main()
+def run_replay(output_dir, record_dir, tests, telemetry):
+    phase = experiment.Phase("replay", "replay", tests, test_runs, 30, output_dir,
+                             record_dir=record_dir, pack_outputs=pack_outputs,
+                             inactivity_timeout=inactivity_timeout, raw_log=raw_log)
+    run_phase(phase, output_dir, telemetry)
+
+def record_and_replay(output_dir, record_dir, tests, telemetry):
+    record = experiment.Phase("record", "record", tests, test_runs, 20, record_dir,
+                              pack_outputs=pack_outputs,
+                              inactivity_timeout=inactivity_timeout, raw_log=raw_log)
+    replay = experiment.Phase("replay", "replay", tests, test_runs, 30, output_dir,
+                              record_dir=record_dir, record_phase="record", pipeline=True,
+                              pack_outputs=pack_outputs,
+                              inactivity_timeout=inactivity_timeout, raw_log=raw_log)
+    run_phases([record, replay], output_dir, telemetry)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+'''
+Always pass, always fail and intermittent tests over a growing directory of
+--log-wptreport json files, like analyse_wpt_results' GetLogOutput and GetIntermittents,
+without parsing the whole history again every time a run is added.
+
+The state file keeps, per test, a bitmask of every status it was seen with, a bitmask of
+the statuses it had while matching its expectation (no "expected" field), and how many
+runs it was seen in. `update` only reads reports which aren't in the state yet. If a
+report which was already counted changed, the state is rebuilt from scratch, a status
+bitmask can't forget a run.
+
+Output, sorted, one test per line:
+
+    output_dir/always_pass_tests.txt
+    output_dir/always_fail_tests.txt
+    output_dir/intermittent_tests.txt
+'''
+
+import json
+import os
+import sys
+
+import wptreport
+
+usage = """\
+Usage: python3 status_sets.py update state.json report_dir/ output_dir/\
+"""
+
+statuses = ["PASS", "FAIL", "OK", "TIMEOUT", "CRASH", "ERROR", "SKIP", "NOTRUN",
+            "PRECONDITION_FAILED"]
+status_bit = {s: 1 << i for (i, s) in enumerate(statuses)}
+
+
+class State:
+    def __init__(self, state_file):
+        self.state_file = state_file
+        # report name -> [size, mtime]
+        self.reports = {}
+        # test -> [status mask, expected status mask, runs]
+        self.tests = {}
+        if os.path.isfile(state_file):
+            state = json.load(open(state_file))
+            self.reports = state["reports"]
+            self.tests = state["tests"]
+
+    def update(self, report_dir):
+        """Count every report not seen yet. Returns how many."""
+        files = wptreport.report_files(report_dir)
+        for json_file in files:
+            stat = os.stat(json_file)
+            seen = self.reports.get(os.path.basename(json_file))
+            if seen is not None and seen != [stat.st_size, stat.st_mtime]:
+                print("{} changed since it was counted, rebuilding state.".format(json_file))
+                self.reports = {}
+                self.tests = {}
+                break
+
+        added = 0
+        for json_file in files:
+            name = os.path.basename(json_file)
+            if name in self.reports:
+                continue
+            print("Reading", json_file)
+            stat = os.stat(json_file)
+            self.add(wptreport.load_results(json_file))
+            self.reports[name] = [stat.st_size, stat.st_mtime]
+            added += 1
+        return added
+
+    def add(self, results):
+        for result in results:
+            entry = self.tests.setdefault(result["test"], [0, 0, 0])
+            bit = status_bit[result["status"]]
+            entry[0] |= bit
+            if "expected" not in result:
+                entry[1] |= bit
+            entry[2] += 1
+
+    def always(self, status):
+        """Tests only ever seen with `status`, and at least once as expected."""
+        bit = status_bit[status]
+        return sorted(t for (t, (mask, expected_mask, _)) in self.tests.items()
+                      if mask == bit and expected_mask & bit)
+
+    def intermittents(self):
+        """Tests seen with more than one status."""
+        return sorted(t for (t, (mask, _, _)) in self.tests.items() if mask & (mask - 1))
+
+    def save(self):
+        with open(self.state_file + ".part", "w") as fout:
+            json.dump({"reports": self.reports, "tests": self.tests}, fout)
+        os.replace(self.state_file + ".part", self.state_file)
+
+
+def write_tests(path, tests):
+    with open(path, "w") as fout:
+        for test in tests:
+            fout.write(test + "\n")
+    print("{} tests written to {}".format(len(tests), path))
+
+
+def main():
+    if len(sys.argv) != 5 or sys.argv[1] != "update":
+        print(usage)
+        sys.exit(1)
+
+    (state_file, report_dir, output_dir) = sys.argv[2:]
+    state = State(state_file)
+    added = state.update(report_dir)
+    state.save()
+    print("Added {} reports, {} in total.".format(added, len(state.reports)))
+
+    os.makedirs(output_dir, exist_ok=True)
+    write_tests(output_dir + "/always_pass_tests.txt", state.always("PASS"))
+    write_tests(output_dir + "/always_fail_tests.txt", state.always("FAIL"))
+    write_tests(output_dir + "/intermittent_tests.txt", state.intermittents())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+'''
+Synthetic inputs for the analysers, at any size, so we can measure how they scale. See
+benchmark.py.
+
+wptreport:  report_dir/ of --log-wptreport json files, for analyse_json_wpt.py,
+            wpt_cache.py, status_sets.py and diff_runs.py.
+outputs:    an output dir as run_baseline leaves it (packed outputs, timeout_file) and
+            its tests file, for analyse_output.
+crash_log:  a mach log with "▶ CRASH" blocks, for scrape_logs.py and index_crashes.py.
+
+Every test has a status it normally gets. Each run of a flaky test has `flip` chance of
+getting another one instead, reported as unexpected like a real run would.
+'''
+
+import argparse
+import json
+import os
+import random
+
+import experiment
+import packs
+
+# Status a test normally gets, and how likely.
+base_statuses = [("PASS", 0.6), ("FAIL", 0.2), ("OK", 0.2)]
+# What a flaky test gets instead.
+flaky_statuses = ["FAIL", "TIMEOUT", "CRASH", "ERROR"]
+flip = 0.3
+
+panics = ["called `Option::unwrap()` on a `None` value", "index out of bounds",
+          "already borrowed: BorrowMutError", "assertion failed: self.is_valid()"]
+frames = ["script::dom::node::Node::remove_child", "script::dom::document::Document::reflow",
+          "layout::flow::BaseFlow::new", "style::stylist::Stylist::push_applicable",
+          "net::http_loader::http_fetch", "script::script_thread::ScriptThread::handle_msg",
+          "std::panicking::begin_panic", "core::result::unwrap_failed"]
+
+
+def test_names(n):
+    return ["/synthetic/dir{}/test{}.html".format(i % 100, i) for i in range(n)]
+
+
+class TestModel:
+    """How a synthetic test behaves."""
+
+    def __init__(self, name, rng, flaky, max_subtests):
+        self.name = name
+        self.flaky = rng.random() < flaky
+        r = rng.random()
+        self.status = base_statuses[-1][0]
+        for (status, p) in base_statuses:
+            if r < p:
+                self.status = status
+                break
+            r -= p
+        self.subtests = rng.randint(1, max_subtests) if self.status == "OK" else 0
+        self.duration = int(rng.lognormvariate(6.5, 1))
+
+    def run(self, rng):
+        """(status, expected status if unexpected else None)"""
+        if self.flaky and rng.random() < flip:
+            status = rng.choice([s for s in flaky_statuses if s != self.status])
+            return (status, self.status)
+        return (self.status, None)
+
+
+def models(tests, flaky, max_subtests, rng):
+    return [TestModel(name, rng, flaky, max_subtests) for name in test_names(tests)]
+
+
+def generate_reports(report_dir, tests, reports, flaky, max_subtests, seed):
+    rng = random.Random(seed)
+    os.makedirs(report_dir, exist_ok=True)
+    tests = models(tests, flaky, max_subtests, rng)
+    for r in range(reports):
+        results = []
+        for test in tests:
+            (status, expected) = test.run(rng)
+            result = {"status": status, "known_intermittent": [], "test": test.name,
+                      "subtests": [], "duration": int(test.duration * rng.uniform(0.8, 1.3)),
+                      "message": None}
+            if expected is not None:
+                result["expected"] = expected
+            if status == "OK":
+                for s in range(test.subtests):
+                    result["subtests"].append({"name": "subtest " + str(s), "status": "PASS",
+                                               "message": None, "known_intermittent": []})
+            elif status == "TIMEOUT" and test.subtests != 0:
+                result["subtests"].append({"name": "subtest 0", "status": "TIMEOUT",
+                                           "expected": "PASS", "message": None,
+                                           "known_intermittent": []})
+            results.append(result)
+
+        report = {"run_info": {"product": "servo", "synthetic": True}, "time_start": 0,
+                  "time_end": 0, "results": results}
+        with open(report_dir + "/results{}.json".format(r), "w") as fout:
+            json.dump(report, fout)
+
+
+def mach_output(test, status, rng):
+    """Output of `mach test-wpt` for one test, as analyse_file reads it."""
+    lines = [" 0:00.{:02d} INFO Running 1 tests".format(rng.randint(10, 99)),
+             " 0:00.50 TEST_START: " + test]
+    if status == "CRASH":
+        lines += crash_block(test, rng)
+    lines.append("")
+    lines.append("Ran 1 tests finished in {:.1f} seconds.".format(rng.uniform(0.2, 9)))
+    if status in ["PASS", "OK"]:
+        lines.append("OK")
+    elif status == "TIMEOUT":
+        lines.append("TIMEOUT " + test)
+    else:
+        lines.append("FAIL " + test)
+    lines.append(" 0:0{}.00 INFO Closing logging queue".format(rng.randint(1, 9)))
+    lines.append(" 0:0{}.00 INFO queue closed".format(rng.randint(1, 9)))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def crash_block(test, rng):
+    block = ["  ▶ CRASH [expected OK] " + test,
+             "  │ thread 'ScriptThread' panicked at '{}', components/script/dom/node.rs:{}"
+             .format(rng.choice(panics), rng.randint(1, 3000)),
+             "  │ stack backtrace:"]
+    for i in range(rng.randint(3, 12)):
+        block.append("  │   {:2d}: {}::h{:016x}".format(i, rng.choice(frames),
+                                                         rng.getrandbits(64)))
+    block.append("  └ ")
+    return block
+
+
+def generate_outputs(output_dir, tests_file, tests, runs, flaky, seed):
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    tests = models(tests, flaky, 1, rng)
+    pack = packs.Pack(output_dir, sync=False)
+    with open(output_dir + "/" + experiment.timeout_file, "w") as fout_timeout:
+        for test in tests:
+            for i in range(runs):
+                (status, _) = test.run(rng)
+                # A flaky run now and then hangs until the rig kills it.
+                if status == "TIMEOUT" and rng.random() < 0.5:
+                    fout_timeout.write(test.name + str(i) + "\n")
+                pack.add(test.name.replace('/', '_') + str(i),
+                         mach_output(test.name, status, rng))
+    pack.close()
+
+    with open(tests_file, "w") as fout:
+        for test in tests:
+            fout.write(test.name + "\n")
+
+
+def generate_crash_log(log_file, blocks, seed):
+    rng = random.Random(seed)
+    with open(log_file, "w") as fout:
+        for i in range(blocks):
+            test = "/synthetic/dir{}/test{}.html".format(i % 100, i)
+            fout.write(" 0:00.50 TEST_START: " + test + "\n")
+            for _ in range(rng.randint(0, 5)):
+                fout.write(" 0:00.60 INFO PID 1234 | some unrelated output\n")
+            fout.write("\n".join(crash_block(test, rng)) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic analyser inputs.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flaky", type=float, default=0.05,
+                        help="Fraction of tests which are flaky.")
+    sub = parser.add_subparsers(dest="kind", required=True)
+
+    p = sub.add_parser("wptreport")
+    p.add_argument("report_dir")
+    p.add_argument("--tests", type=int, default=1000)
+    p.add_argument("--reports", type=int, default=10)
+    p.add_argument("--subtests", type=int, default=5, help="Most subtests of an OK test.")
+
+    p = sub.add_parser("outputs")
+    p.add_argument("output_dir")
+    p.add_argument("tests_file")
+    p.add_argument("--tests", type=int, default=100)
+    p.add_argument("--runs", type=int, default=100)
+
+    p = sub.add_parser("crash_log")
+    p.add_argument("log_file")
+    p.add_argument("--blocks", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.kind == "wptreport":
+        generate_reports(args.report_dir, args.tests, args.reports, args.flaky, args.subtests,
+                         args.seed)
+    elif args.kind == "outputs":
+        generate_outputs(args.output_dir, args.tests_file, args.tests, args.runs, args.flaky,
+                         args.seed)
+    else:
+        generate_crash_log(args.log_file, args.blocks, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''
+Runner telemetry. Every event (spawn, finish, timeout, record failure, queue changes) is
+appended to a JSON-lines event log, and a Prometheus textfile (as read by node_exporter's
+textfile collector) with the running totals is rewritten periodically from a background
+thread. Either output can be disabled by passing None.
+'''
+
+import json
+import os
+import threading
+import time
+
+import wptreport
+
+prefix = "rr_runner_"
+
+
+class Telemetry:
+    def __init__(self, events_file, textfile, interval=15, slots=1):
+        self.lock = threading.Lock()
+        self.events = None if events_file is None else open(events_file, "a")
+        self.textfile = textfile
+        self.interval = interval
+        self.started = time.time()
+
+        self.queue_depth = 0
+        self.active_slots = 0
+        self.slots = slots
+        # (metric name, mode) -> value. Counters and the _sum/_count of summaries.
+        self.counters = {}
+
+        self.stopped = threading.Event()
+        self.writer = None
+        if textfile is not None:
+            self.writer = threading.Thread(target=self.write_periodically, daemon=True)
+            self.writer.start()
+
+    def spawned(self, mode, test, run, latency):
+        """A job was started. `latency` is how long Popen took, in seconds."""
+        with self.lock:
+            self.active_slots += 1
+            self.queue_depth = max(self.queue_depth - 1, 0)
+            self.count("jobs_spawned_total", mode)
+            self.observe("spawn_latency_seconds", mode, latency)
+        self.event("spawn", mode=mode, test=test, run=run, latency=latency,
+                   queue_depth=self.queue_depth, active_slots=self.active_slots)
+
+    def finished(self, mode, test, run, wall, returncode, hung=False):
+        """
+        A job was reaped. `returncode` is None if it was killed, because it timed out or,
+        if `hung`, went silent.
+        """
+        with self.lock:
+            self.active_slots = max(self.active_slots - 1, 0)
+            self.count("jobs_finished_total", mode)
+            self.observe("job_wall_seconds", mode, wall)
+            if hung:
+                self.count("hangs_total", mode)
+            elif returncode is None:
+                self.count("timeouts_total", mode)
+        if hung:
+            self.event("hang", mode=mode, test=test, run=run, wall=wall)
+        elif returncode is None:
+            self.event("timeout", mode=mode, test=test, run=run, wall=wall)
+        self.event("finish", mode=mode, test=test, run=run, wall=wall, returncode=returncode,
+                   active_slots=self.active_slots)
+
+    def record_failed(self, test, attempt):
+        with self.lock:
+            self.count("record_failures_total", "record")
+        self.event("record_fail", mode="record", test=test, run=attempt)
+
+    def set_queue_depth(self, depth):
+        with self.lock:
+            self.queue_depth = depth
+        self.event("queue", queue_depth=depth, active_slots=self.active_slots)
+
+    def count(self, name, mode, value=1):
+        key = (name, mode)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, mode, value):
+        self.count(name + "_sum", mode, value)
+        self.count(name + "_count", mode)
+
+    def event(self, kind, **fields):
+        if self.events is None:
+            return
+        fields["time"] = time.time()
+        fields["event"] = kind
+        with self.lock:
+            self.events.write(json.dumps(fields) + "\n")
+            self.events.flush()
+
+    def write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write_textfile()
+
+    def write_textfile(self):
+        """Write to a temporary name first so the collector never sees a partial file."""
+        with self.lock:
+            lines = [
+                "# TYPE {}queue_depth gauge".format(prefix),
+                "{}queue_depth {}".format(prefix, self.queue_depth),
+                "# TYPE {}active_slots gauge".format(prefix),
+                "{}active_slots {}".format(prefix, self.active_slots),
+                "# TYPE {}slots gauge".format(prefix),
+                "{}slots {}".format(prefix, self.slots),
+                "# TYPE {}uptime_seconds gauge".format(prefix),
+                "{}uptime_seconds {}".format(prefix, time.time() - self.started),
+            ]
+            seen_types = set()
+            for ((name, mode), value) in sorted(self.counters.items()):
+                base = name
+                for suffix in ["_sum", "_count"]:
+                    if name.endswith(suffix):
+                        base = name[:-len(suffix)]
+                if base not in seen_types:
+                    kind = "counter" if base == name else "summary"
+                    lines.append("# TYPE {}{} {}".format(prefix, base, kind))
+                    seen_types.add(base)
+                lines.append('{}{}{{mode="{}"}} {}'.format(prefix, name, mode, value))
+
+        temp_file = self.textfile + wptreport.temp_suffix
+        with open(temp_file, "w") as fout:
+            fout.write("\n".join(lines) + "\n")
+        os.replace(temp_file, self.textfile)
+
+    def close(self):
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.write_textfile()
+        if self.events is not None:
+            self.events.close()
@@ -0,0 +1,136 @@
+'''
+Watch a dir for files being written, so output dirs can be aggregated while an experiment
+is still running without rescanning them. Uses inotify through libc, there is no binding
+in the standard library, and falls back to polling the dir where that isn't available.
+
+    watcher = Watcher(output_dir)
+    for name in watcher.changes(timeout):
+        ...
+
+`Tail` reads the lines appended to a file since it last looked.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+event_header = struct.Struct("iIII")
+
+
+def inotify_fd(directory):
+    """An inotify fd watching `directory`, or None if there is no inotify."""
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Watcher:
+    """
+    Names of files in `directory` created, written to or moved into it. The first call
+    returns every file already there.
+    """
+
+    def __init__(self, directory, use_inotify=True):
+        self.directory = directory
+        self.fd = inotify_fd(directory) if use_inotify else None
+        # Polling: name -> (size, mtime) at the last look.
+        self.seen = {}
+        self.rescan = True
+
+    def changes(self, timeout):
+        """Waits up to `timeout` seconds for something to change."""
+        if self.fd is None:
+            return self.poll(timeout)
+        if self.rescan:
+            self.rescan = False
+            self.drain()
+            return set(os.listdir(self.directory))
+
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if readable == []:
+            return set()
+        (names, overflow) = self.drain()
+        if overflow:
+            # Lost events, anything could have changed.
+            return set(os.listdir(self.directory))
+        return names
+
+    def drain(self):
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return (names, overflow)
+            offset = 0
+            while offset < len(data):
+                (_, mask, _, length) = event_header.unpack_from(data, offset)
+                offset += event_header.size
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name != b"":
+                    names.add(os.fsdecode(name))
+
+    def poll(self, timeout):
+        if not self.rescan:
+            time.sleep(timeout)
+        self.rescan = False
+        names = set()
+        seen = {}
+        for entry in os.scandir(self.directory):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            seen[entry.name] = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(entry.name) != seen[entry.name]:
+                names.add(entry.name)
+        self.seen = seen
+        return names
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Tail:
+    """The complete lines appended to `path` since the last call."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def lines(self):
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, "rb") as fin:
+            fin.seek(self.offset)
+            data = fin.read()
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return [line.decode("utf-8") for line in data[:end].split(b"\n")[:-1]]
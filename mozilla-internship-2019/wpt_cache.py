@@ -0,0 +1,179 @@
+'''
+Columnar cache of --log-wptreport json files, so the same reports are only ever parsed
+once. `convert` writes every new or changed report in report_dir/ as NumPy columns:
+
+    cache_dir/tests.txt          string table, line i is the name of test id i
+    cache_dir/manifest.json      which report lives in which column dir
+    cache_dir/rN/test_id.npy     int32, index into tests.txt
+    cache_dir/rN/status.npy      int8, index into `statuses`
+    cache_dir/rN/expected.npy    int8, index into `statuses`, -1 if there was no "expected"
+    cache_dir/rN/unexpected.npy  bool, see wptreport.is_unexpected
+    cache_dir/rN/duration.npy    int64, ms
+
+`analyse` memory maps the columns and prints the same table as analyse_json_wpt.py,
+without decoding any json.
+'''
+
+import json
+import os
+import sys
+
+import numpy as np
+
+import wptreport
+
+usage = """\
+Usage: python3 wpt_cache.py convert report_dir/ cache_dir/
+                            analyse cache_dir/ [all|tests_to_analyse.txt]\
+"""
+
+statuses = ["PASS", "FAIL", "OK", "TIMEOUT", "CRASH", "ERROR", "SKIP", "NOTRUN",
+            "PRECONDITION_FAILED"]
+status_code = {s: i for (i, s) in enumerate(statuses)}
+
+columns = ["test_id", "status", "expected", "unexpected", "duration"]
+
+
+class Cache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.tests = []
+        tests_file = cache_dir + "/tests.txt"
+        if os.path.isfile(tests_file):
+            self.tests = open(tests_file).read().split("\n")[:-1]
+        self.test_ids = {t: i for (i, t) in enumerate(self.tests)}
+
+        self.manifest = {"reports": {}}
+        manifest_file = cache_dir + "/manifest.json"
+        if os.path.isfile(manifest_file):
+            self.manifest = json.load(open(manifest_file))
+
+    def test_id(self, name):
+        if name not in self.test_ids:
+            self.test_ids[name] = len(self.tests)
+            self.tests.append(name)
+        return self.test_ids[name]
+
+    def convert(self, report_dir):
+        """Convert every report which isn't cached yet, or changed since. Returns how many."""
+        converted = 0
+        for json_file in wptreport.report_files(report_dir):
+            stat = os.stat(json_file)
+            name = os.path.basename(json_file)
+            entry = self.manifest["reports"].get(name)
+            if entry is not None and entry["size"] == stat.st_size \
+                    and entry["mtime"] == stat.st_mtime:
+                continue
+
+            print("Converting", json_file)
+            if entry is None:
+                entry = {"dir": "r" + str(len(self.manifest["reports"]))}
+            self.write_columns(self.cache_dir + "/" + entry["dir"],
+                               wptreport.load_results(json_file))
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+            self.manifest["reports"][name] = entry
+            converted += 1
+
+        # Columns first, then the table and manifest pointing at them.
+        wptreport.write_atomically(self.cache_dir + "/tests.txt",
+                                   "".join(t + "\n" for t in self.tests).encode())
+        wptreport.write_atomically(self.cache_dir + "/manifest.json",
+                                   json.dumps(self.manifest).encode())
+        return converted
+
+    def write_columns(self, column_dir, results):
+        os.makedirs(column_dir, exist_ok=True)
+        n = len(results)
+        data = {
+            "test_id": np.empty(n, dtype=np.int32),
+            "status": np.empty(n, dtype=np.int8),
+            "expected": np.empty(n, dtype=np.int8),
+            "unexpected": np.empty(n, dtype=np.bool_),
+            "duration": np.empty(n, dtype=np.int64),
+        }
+        for (i, result) in enumerate(results):
+            data["test_id"][i] = self.test_id(result["test"])
+            data["status"][i] = status_code[result["status"]]
+            data["expected"][i] = status_code.get(result.get("expected"), -1)
+            data["unexpected"][i] = wptreport.is_unexpected(result)
+            data["duration"][i] = result["duration"]
+
+        for column in columns:
+            np.save(column_dir + "/" + column + ".npy", data[column])
+
+    def reports(self):
+        """Memory mapped columns of every cached report, as dicts."""
+        for entry in self.manifest["reports"].values():
+            column_dir = self.cache_dir + "/" + entry["dir"]
+            yield {c: np.load(column_dir + "/" + c + ".npy", mmap_mode="r") for c in columns}
+
+
+def analyse(cache, tests_to_analyse):
+    """Per test counts, as analyse_json_wpt.py computes them, for all tests or the given ones."""
+    n = len(cache.tests)
+    totals = {name: np.zeros(n, dtype=np.int64)
+              for name in ["expected", "unexpected", "crash", "timeout", "skip", "error",
+                           "seen"]}
+    expected_runtime = np.zeros(n, dtype=np.float64)
+
+    wanted = None
+    if tests_to_analyse is not None:
+        wanted = np.array([cache.test_ids[t] for t in tests_to_analyse if t in cache.test_ids],
+                          dtype=np.int32)
+
+    # PASS, FAIL and OK count as expected or unexpected, the rest by their own status.
+    graded = np.array([status_code["PASS"], status_code["FAIL"], status_code["OK"]])
+    for report in cache.reports():
+        ids = report["test_id"]
+        status = report["status"]
+        mask = np.ones(len(ids), dtype=np.bool_) if wanted is None else np.isin(ids, wanted)
+
+        is_graded = mask & np.isin(status, graded)
+        is_expected = is_graded & ~report["unexpected"]
+        masks = {
+            "expected": is_expected,
+            "unexpected": is_graded & report["unexpected"],
+            "crash": mask & (status == status_code["CRASH"]),
+            "timeout": mask & (status == status_code["TIMEOUT"]),
+            "skip": mask & (status == status_code["SKIP"]),
+            "error": mask & (status == status_code["ERROR"]),
+            "seen": mask,
+        }
+        for (name, m) in masks.items():
+            totals[name] += np.bincount(ids[m], minlength=n)
+        expected_runtime += np.bincount(ids[is_expected], weights=report["duration"][is_expected],
+                                        minlength=n)
+
+    return (totals, expected_runtime)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        cache = Cache(sys.argv[3])
+        converted = cache.convert(sys.argv[2])
+        print("Converted {} reports, {} cached.".format(converted,
+                                                        len(cache.manifest["reports"])))
+    elif len(sys.argv) in [3, 4] and sys.argv[1] == "analyse":
+        cache = Cache(sys.argv[2])
+        tests_to_analyse = None
+        if len(sys.argv) == 4 and sys.argv[3] != "all":
+            tests_to_analyse = [line.strip() for line in open(sys.argv[3])]
+
+        (totals, expected_runtime) = analyse(cache, tests_to_analyse)
+        print("NAME, EXPECTED, UNEXPECTED, CRASH, TIMEOUT, SKIP, ERROR")
+        for i in sorted(np.nonzero(totals["seen"])[0], key=lambda i: cache.tests[i]):
+            # Same as analyse_json_wpt.py, the last column is the total expected runtime.
+            print("{}, {}, {}, {}, {}, {}, {}, {}".format(
+                cache.tests[i], totals["expected"][i], totals["unexpected"][i],
+                totals["crash"][i], totals["timeout"][i], totals["skip"][i],
+                totals["error"][i], int(expected_runtime[i])))
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+'''
+Pre-flight check of test lists against WPT's MANIFEST.json, so tests which no longer exist
+are dropped before mach is ever spawned for them, instead of being found by
+`analyse_do_not_exist` after `test_runs` wasted runs each.
+
+Servo has two manifests, tests/wpt/metadata/MANIFEST.json for upstream WPT and
+tests/wpt/mozilla/meta/MANIFEST.json for its own tests (url_base /_mozilla/). A test
+exists if it is the path of a test file or one of its URLs (e.g. foo.any.html of
+foo.any.js) in any of them.
+
+Parsing the manifests takes a while, so the set of known tests is cached in `cache_dir`
+as a sorted text file named after the sha256 of the manifests it came from. Updating a
+manifest simply makes a new cache entry.
+'''
+
+import hashlib
+import json
+import os
+import sys
+
+import wptreport
+
+usage = """\
+Usage: python3 wpt_manifest.py tests_file MANIFEST.json... [-o existing_tests_file]
+
+Prints the tests in tests_file which are in none of the manifests. With -o, writes the
+ones which are to existing_tests_file.\
+"""
+
+cache_dir = os.path.expanduser("~/.cache/rr-channel-experiments/wpt_manifest")
+
+# Not tests, but listed in the manifest.
+ignored_types = ["support"]
+
+
+def manifest_hash(manifest_files):
+    h = hashlib.sha256()
+    for manifest_file in manifest_files:
+        with open(manifest_file, "rb") as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def load_known_tests(manifest_files):
+    """Set of every test path and URL in `manifest_files`, cached by their hash."""
+    cache_file = cache_dir + "/" + manifest_hash(manifest_files) + ".txt"
+    if os.path.isfile(cache_file):
+        return set(open(cache_file).read().split("\n")[:-1])
+
+    known = set()
+    for manifest_file in manifest_files:
+        print("Parsing", manifest_file)
+        known.update(parse_manifest(json.load(open(manifest_file))))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + ".part", "w") as fout:
+        for test in sorted(known):
+            fout.write(test + "\n")
+    os.replace(cache_file + ".part", cache_file)
+    return known
+
+
+def parse_manifest(manifest):
+    url_base = manifest.get("url_base", "/")
+    for (test_type, items) in manifest["items"].items():
+        if test_type not in ignored_types:
+            yield from manifest_items(items, "", url_base)
+
+
+def manifest_items(items, prefix, url_base):
+    """
+    Since version 8 `items` is a tree of directories, with each file as
+    [hash, [url or null, extras]...]. Before it was flat, each path as [[url, extras]...].
+    """
+    for (name, value) in items.items():
+        path = prefix + name
+        if isinstance(value, dict):
+            yield from manifest_items(value, path + "/", url_base)
+            continue
+
+        yield url_base + path
+        for item in value:
+            if isinstance(item, list) and item != [] and isinstance(item[0], str):
+                url = item[0]
+                yield url if url.startswith("/") else url_base + url
+
+
+def check(tests, known):
+    """(tests which exist, tests which don't), in the order of `tests`."""
+    existing = []
+    missing = []
+    for test in tests:
+        (existing if test in known else missing).append(test)
+    return (existing, missing)
+
+
+def preflight(tests, known, output_dir):
+    """
+    `tests` without the ones which aren't `known`, which are listed in
+    output_dir/tests_that_no_longer_exist.txt instead.
+    """
+    (existing, missing) = check(tests, known)
+    if missing != []:
+        os.makedirs(output_dir, exist_ok=True)
+        missing_file = output_dir + "/" + wptreport.missing_tests_file
+        with open(missing_file, "w") as fout:
+            for test in missing:
+                fout.write(test + "\n")
+        print("Skipping {} tests which no longer exist, see {}".format(len(missing),
+                                                                     missing_file))
+    return existing
+
+
+def main():
+    args = sys.argv[1:]
+    existing_file = None
+    if "-o" in args:
+        i = args.index("-o")
+        if i + 1 >= len(args):
+            print(usage)
+            sys.exit(1)
+        existing_file = args[i + 1]
+        del args[i:i + 2]
+
+    if len(args) < 2:
+        print(usage)
+        sys.exit(1)
+
+    tests = [line.strip() for line in open(args[0])]
+    tests = [t for t in tests if t != "" and not t.startswith("#")]
+    (existing, missing) = check(tests, load_known_tests(args[1:]))
+
+    for test in missing:
+        print("Does not exist: ", test)
+    print("{} of {} tests do not exist.".format(len(missing), len(tests)))
+
+    if existing_file is not None:
+        with open(existing_file, "w") as fout:
+            for test in existing:
+                fout.write(test + "\n")
+
+
+if __name__ == "__main__":
+    main()
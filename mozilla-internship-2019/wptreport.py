@@ -0,0 +1,84 @@
+'''
+Helpers shared by the scripts that read the json files produced by
+./mach test-wpt --headless --release --log-wptreport ../path/to/results
+and the output dirs of run_intermittent_failures_tests.py / experiment.py, with the names
+of the files in those.
+'''
+
+import json
+import os
+
+# Names of the files every phase keeps next to its outputs.
+timeout_file = "timeout_file"
+hang_file = "hang_file"
+rusage_file = "rusage_file"
+fingerprint_file = "fingerprints"
+status_file = "status_file"
+journal_file = "journal"
+# Default names of the runner's telemetry files.
+telemetry_events_file = "runner_events.jsonl"
+telemetry_textfile = "runner.prom"
+# Tests dropped for being in no WPT manifest, see wpt_manifest.py.
+missing_tests_file = "tests_that_no_longer_exist.txt"
+# Default names of watch_output's CSV and summary.
+live_results_file = "live_results.csv"
+live_summary_file = "live_summary.txt"
+# Every file the runner keeps next to outputs in an output dir.
+output_dir_files = [timeout_file, hang_file, rusage_file, fingerprint_file, status_file,
+                    journal_file, telemetry_events_file, telemetry_textfile,
+                    missing_tests_file, live_results_file, live_summary_file]
+
+# Suffixes of files which are still being written, outputs and the telemetry textfile.
+part_suffix = ".part"
+temp_suffix = ".tmp"
+
+
+def read_tests(test_file):
+    """Tests of a file with one per line. Blank lines and # comments are skipped."""
+    tests = []
+    for line in open(test_file):
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            tests.append(line)
+    return tests
+
+
+def write_atomically(path, contents):
+    """Write bytes `contents` to `path` so that readers never see half of it."""
+    with open(path + part_suffix, "wb") as fout:
+        fout.write(contents)
+    os.replace(path + part_suffix, path)
+
+
+def is_wptreport_dir(directory):
+    """True if `directory` looks like a directory of --log-wptreport json files."""
+    return len(report_files(directory)) != 0
+
+
+def report_files(report_dir):
+    """Sorted paths of all json files in `report_dir`."""
+    files = []
+    for filename in sorted(os.listdir(report_dir)):
+        if filename.endswith(".json"):
+            files.append(report_dir + "/" + filename)
+    return files
+
+
+def load_results(json_file):
+    """The list of per test results in a single wptreport file."""
+    return json.load(open(json_file))["results"]
+
+
+def is_unexpected(result):
+    """
+    This may look funny but it is correct. We only see "expected" as a field if we got
+    the wrong status, that is, we saw an unexpected result. Tests with status OK report
+    their real outcome through their subtests.
+    """
+    if "expected" in result:
+        return True
+    if result["status"] == "OK":
+        for subtest in result["subtests"]:
+            if "expected" in subtest:
+                return True
+    return False
@@ -0,0 +1,212 @@
+'''
+Inverted index over the "▶ CRASH" blocks of mach logs, so we can ask which tests crashed
+in a given function without grepping every log again.
+
+`build` attributes every crash block (see scrape_logs.crash_blocks) to its test and the log
+it came from, and indexes the Rust paths, source files and words of its stack frames and
+panic message. Logs already in the index are skipped unless their size or mtime changed,
+so the index can be refreshed as new runs come in. Raw structured logs (mach --log-raw)
+are indexed the same way, see scrape_logs.raw_crash_block. Output dirs are read run by
+run, packed outputs included, see scrape_logs.logs.
+
+`search` prints the blocks containing all given tokens. A token ending in "::", "..." or
+"*" matches every token starting with it:
+
+    python3 index_crashes.py search crashes.db script::dom::...
+'''
+
+import contextlib
+import os
+import re
+import sqlite3
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from scrape_logs import crash_blocks, logs
+
+usage = """\
+Usage: python3 index_crashes.py build index.db log_file_or_dir/...
+                                search index.db [--show] token...\
+"""
+
+schema = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    -- Size and mtime of a file, length and offset in the pack of a packed output.
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    log INTEGER NOT NULL REFERENCES logs(id),
+    test TEXT,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    block INTEGER NOT NULL REFERENCES blocks(id),
+    PRIMARY KEY (token, block)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blocks_log ON blocks(log);
+"""
+
+# " 0:01.23 TEST_START: /css/foo.html" (mach) or "TEST-START | /css/foo.html" (tbpl).
+test_start = re.compile(r"TEST[_-]START(?::| \|) (\S+)")
+# script::dom::node::Node::remove_child, optionally followed by its symbol hash.
+rust_path = re.compile(r"[A-Za-z_][\w<>]*(?:::[A-Za-z_<][\w<>]*)+")
+symbol_hash = re.compile(r"::h[0-9a-f]{16}$")
+source_file = re.compile(r"[\w./-]+\.rs")
+word = re.compile(r"[A-Za-z_]\w{2,}")
+
+
+class LogReader:
+    """
+    Iterates over the lines of a log, remembering the current line number and the last
+    test started, so whoever consumes crash_blocks(reader) knows where a block came from.
+    """
+
+    def __init__(self, f: Iterable[str]):
+        self.f = f
+        self.line = 0
+        self.test: Optional[str] = None
+        # Line the last block started on. A raw log's block is a single event line.
+        self.block_line = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.f:
+            self.line += 1
+            m = test_start.search(line)
+            if m:
+                self.test = m.group(1)
+            if line.startswith(("  ▶ CRASH", "{")):
+                self.block_line = self.line
+            yield line
+
+
+def block_test(block: List[str], last_started: Optional[str]) -> Optional[str]:
+    """The test a block belongs to: "  ▶ CRASH [expected OK] /test.html" names it."""
+    header = block[0].split()
+    if header and header[-1].startswith("/"):
+        return header[-1]
+    return last_started
+
+
+def tokenize(text: str) -> Set[str]:
+    tokens = set()
+    for path in rust_path.findall(text):
+        parts = symbol_hash.sub("", path).split("::")
+        # Full path for prefix searches, and its tails so Node::remove_child finds it too.
+        for i in range(len(parts) - 1):
+            tokens.add("::".join(parts[i:]))
+    for path in source_file.findall(text):
+        tokens.add(path)
+        tokens.add(os.path.basename(path))
+    tokens.update(w.lower() for w in word.findall(text))
+    return tokens
+
+
+def build(db: sqlite3.Connection, paths: List[str]) -> Tuple[int, int]:
+    """Index every new or changed log. Returns (logs indexed, blocks indexed)."""
+    indexed_logs = 0
+    indexed_blocks = 0
+    for (path, (size, mtime), lines) in logs(paths):
+        path = os.path.abspath(path)
+        row = db.execute("SELECT id, size, mtime FROM logs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1] == size and row[2] == mtime:
+            continue
+
+        with db:
+            if row is not None:
+                # Log changed since we indexed it, start over.
+                db.execute("DELETE FROM postings WHERE block IN "
+                           "(SELECT id FROM blocks WHERE log = ?)", (row[0],))
+                db.execute("DELETE FROM blocks WHERE log = ?", (row[0],))
+                db.execute("DELETE FROM logs WHERE id = ?", (row[0],))
+            log_id = db.execute("INSERT INTO logs (path, size, mtime) VALUES (?, ?, ?)",
+                                (path, size, mtime)).lastrowid
+
+            reader = LogReader(lines())
+            for block in crash_blocks(reader):
+                text = "".join(block)
+                first_line = reader.block_line
+                block_id = db.execute(
+                    "INSERT INTO blocks (log, test, line, text) VALUES (?, ?, ?, ?)",
+                    (log_id, block_test(block, reader.test), first_line, text)).lastrowid
+                db.executemany("INSERT INTO postings (token, block) VALUES (?, ?)",
+                               [(token, block_id) for token in tokenize(text)])
+                indexed_blocks += 1
+        indexed_logs += 1
+    return (indexed_logs, indexed_blocks)
+
+
+def matching_blocks(db: sqlite3.Connection, token: str) -> Set[int]:
+    for suffix in ["...", "*"]:
+        if token.endswith(suffix):
+            token = token[:-len(suffix)]
+            break
+    else:
+        if not token.endswith("::"):
+            rows = db.execute("SELECT block FROM postings WHERE token = ?", (token,))
+            return {r[0] for r in rows}
+
+    # Prefix search, a range scan over the primary key.
+    rows = db.execute("SELECT block FROM postings WHERE token >= ? AND token < ?",
+                      (token, token + "\U0010ffff"))
+    return {r[0] for r in rows}
+
+
+def search(db: sqlite3.Connection, tokens: List[str]) -> List[Tuple[Optional[str], str, int, str]]:
+    """(test, log path, line, text) of every block containing all `tokens`."""
+    blocks: Optional[Set[int]] = None
+    for token in tokens:
+        found = matching_blocks(db, token)
+        blocks = found if blocks is None else blocks & found
+        if not blocks:
+            return []
+
+    results = []
+    for block_id in sorted(blocks or []):
+        results.append(db.execute(
+            "SELECT blocks.test, logs.path, blocks.line, blocks.text FROM blocks "
+            "JOIN logs ON logs.id = blocks.log WHERE blocks.id = ?", (block_id,)).fetchone())
+    return results
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ["build", "search"]:
+        print(usage)
+        sys.exit(1)
+
+    with contextlib.closing(sqlite3.connect(sys.argv[2])) as db:
+        db.executescript(schema)
+
+        if sys.argv[1] == "build":
+            (logs, blocks) = build(db, sys.argv[3:])
+            total = db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+            print("Indexed {} crash blocks from {} logs, {} blocks in total."
+                  .format(blocks, logs, total))
+            return
+
+        tokens = sys.argv[3:]
+        show = "--show" in tokens
+        tokens = [t for t in tokens if t != "--show"]
+        if tokens == []:
+            print(usage)
+            sys.exit(1)
+
+        results = search(db, tokens)
+        per_test: Dict[Optional[str], int] = {}
+        for (test, path, line, text) in results:
+            per_test[test] = per_test.get(test, 0) + 1
+            print("{}, {}:{}".format(test, path, line))
+            if show:
+                print(text)
+
+        print("")
+        print("{} crash blocks in {} tests.".format(len(results), len(per_test)))
+
+
+if __name__ == "__main__":
+    main()
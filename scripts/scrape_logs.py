@@ -1,19 +1,83 @@
+import json
+import os
 import sys
-from typing import List, Any
+from typing import Callable, Iterable, Iterator, List, Optional, Any, Tuple
 
+# packs.py and wptreport.py live with the runner.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                "mozilla-internship-2019"))
+import packs
+import wptreport
+
+# (path, stamp, lines), see logs.
+Log = Tuple[str, Tuple[int, float], Callable[[], Iterable[str]]]
 
 def main():
     if len(sys.argv) < 2:
-        print("usage: python3 scrape_logs.pyt input_file.log")
+        print("usage: python3 scrape_logs.pyt input_file.log_or_output_dir/...")
         return
 
-    f = open(sys.argv[1])
+    # Name the run of every block unless there is only one log.
+    attribute = len(sys.argv) > 2 or os.path.isdir(sys.argv[1])
+    for (path, _, lines) in logs(sys.argv[1:]):
+        for error in crash_blocks(lines()):
+            if attribute:
+                print(path)
+            print("".join(error))
+            print("")
+
+
+def logs(paths: List[str]) -> Iterator[Log]:
+    """
+    (path, stamp, lines) of every log in `paths`, files or dirs. Every output packed in an
+    output dir (see packs.py) is a log of its own, with the path its loose file would have.
+    The pack and its index, .record files and the files runs keep next to their outputs
+    are skipped. `stamp` changes whenever the log does, `lines()` reads it.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield file_log(path)
+            continue
+        for (root, _, files) in os.walk(path):
+            packed = set()
+            if packs.index_file in files:
+                outputs = packs.Outputs(root)
+                for name in sorted(outputs.index):
+                    packed.add(name)
+                    yield packed_log(outputs, root, name)
+            for name in sorted(files):
+                if name in packed or name in [packs.pack_file, packs.index_file] \
+                        or name in wptreport.output_dir_files \
+                        or name.endswith((".record", ".record_fail", wptreport.part_suffix,
+                                          wptreport.temp_suffix)):
+                    continue
+                yield file_log(os.path.join(root, name))
+
+
+def file_log(path: str) -> Log:
+    stat = os.stat(path)
+    return (path, (stat.st_size, stat.st_mtime), lambda: open(path, errors="replace"))
+
+
+def packed_log(outputs: packs.Outputs, output_dir: str, name: str) -> Log:
+    # Changed contents are appended at a new offset, unchanged ones keep theirs.
+    (offset, length, _) = outputs.index[name]
 
-    all_errors: List[str] = []
+    def lines() -> List[str]:
+        return outputs.read(name).decode("utf-8", errors="replace").splitlines(keepends=True)
+
+    return (os.path.join(output_dir, name), (length, offset), lines)
+
+
+def crash_blocks(f: Iterable[str]) -> Iterator[List[str]]:
+    """
+    Yields every "▶ CRASH" block in the log as its list of lines. Crashes in a raw
+    structured log (mach --log-raw) are yielded as the block mach would have printed.
+    """
     # Keeps track if we're currently reading an error message from log.
     on_error = False
     # List of lines (strings) representing the current error.
-    current_error = []
+    current_error: List[str] = []
     for line in f:
         if on_error:
             # In the middle of error...
@@ -23,21 +87,48 @@ def main():
             elif line.startswith("  └ "):
                 current_error.append(line)
                 on_error = False
-                error_msg = "".join(current_error)
-                # Clear out list for next error.
-                all_errors.append(error_msg)
-                current_error.clear()
+                yield current_error
+                # Fresh list for next error.
+                current_error = []
         else:
+            if line.startswith("{"):
+                block = raw_crash_block(line)
+                if block is not None:
+                    yield block
             # We found the beginning of the error save it!
-            if line.startswith("  ▶ CRASH"):
+            elif line.startswith("  ▶ CRASH"):
                 if current_error:
                     print("Error, current_error list not empty!")
                 on_error = True
                 current_error.append(line)
 
-    for e in all_errors:
-        print(e)
-        print("")
+
+def raw_crash_block(line: str) -> Optional[List[str]]:
+    """The "▶ CRASH" block of a raw log event, None if it isn't a crash."""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict):
+        return None
+
+    action = event.get("action")
+    if action == "test_end" and event.get("status") == "CRASH":
+        header = "expected " + event.get("expected", "CRASH")
+        details = [event.get("message"), event.get("stack")]
+    elif action == "crash":
+        header = "process {}".format(event["process"]) if "process" in event else "crash"
+        details = [event.get("signature"), event.get("reason"), event.get("stackwalk_stdout"),
+                   event.get("java_stack")]
+    else:
+        return None
+
+    block = ["  ▶ CRASH [{}] {}\n".format(header, event.get("test") or "")]
+    for detail in details:
+        if detail:
+            block.extend("  │ " + l + "\n" for l in str(detail).splitlines())
+    block.append("  └ \n")
+    return block
 
 
 if __name__ == "__main__":